@@ -0,0 +1,127 @@
+# auditoria.py
+"""Escritura asíncrona de la tabla ``auditoria``.
+
+Las rutas encolan el registro y responden; un hilo lo inserta en lotes con
+su propia sesión. La fecha la pone MySQL al insertar (``server_default``),
+igual que antes: un solo reloj para todos los workers, que es lo que
+suponen los filtros por fecha y el cursor (fecha, id) de /auditoria. A
+cambio, la fecha puede atrasarse respecto de la acción lo que tarde el lote
+en escribirse (normalmente milisegundos; segundos si hay reintentos). Si el hilo
+no está corriendo (scripts, init.py) se escribe en el momento con la sesión
+de quien llama.
+
+La cola es acotada: si se llena (la base no da abasto) la ruta espera un
+momento y, si sigue llena, escribe ella misma en forma síncrona. Un lote que
+falla se reintenta con espera creciente y, si no hay caso, fila por fila
+para no perder las buenas por una mala. Al salir del intérprete se vacía
+la cola; ante un kill -9 se pierde a lo sumo lo encolado (``MAX_COLA``).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+import database
+import models
+
+MAX_LOTE = 500
+MAX_COLA = 5000
+# Segundos que una ruta espera lugar en la cola antes de escribir ella misma
+ESPERA_COLA = 0.5
+# Esperas entre reintentos de un lote fallido
+REINTENTOS = (0.5, 2, 5)
+
+logger = logging.getLogger(__name__)
+
+_FIN = object()
+
+
+class AuditoriaWriter:
+    def __init__(self):
+        self._cola = queue.Queue(maxsize=MAX_COLA)
+        self._hilo = None
+        atexit.register(self.detener)
+
+    @property
+    def activo(self) -> bool:
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def iniciar(self) -> None:
+        if not self.activo:
+            self._hilo = threading.Thread(target=self._loop, name="auditoria-writer", daemon=True)
+            self._hilo.start()
+
+    def detener(self) -> None:
+        """Escribe lo pendiente y termina el hilo."""
+        if self.activo:
+            self._cola.put(_FIN)
+            self._hilo.join()
+        self._hilo = None
+
+    def registrar(self, db, usuario_id, accion, detalle="", ip_address="", entidad_tipo=None, entidad_id=None) -> None:
+        registro = {
+            "usuario_id": usuario_id,
+            "accion": accion,
+            "detalle": detalle,
+            "ip_address": ip_address,
+            "entidad_tipo": entidad_tipo,
+            "entidad_id": entidad_id
+        }
+        if self.activo:
+            try:
+                self._cola.put(registro, timeout=ESPERA_COLA)
+                return
+            except queue.Full:
+                logger.warning("Cola de auditoría llena; se escribe en forma síncrona")
+        db.add(models.Auditoria(**registro))
+        db.commit()
+
+    def _loop(self) -> None:
+        while True:
+            registro = self._cola.get()
+            lote = []
+            fin = registro is _FIN
+            if not fin:
+                lote.append(registro)
+            while not fin and len(lote) < MAX_LOTE:
+                try:
+                    registro = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if registro is _FIN:
+                    fin = True
+                else:
+                    lote.append(registro)
+            if lote:
+                self._escribir(lote)
+            if fin:
+                return
+
+    def _escribir(self, lote: list[dict]) -> None:
+        for espera in (*REINTENTOS, None):
+            if self._insertar(lote):
+                return
+            if espera is not None:
+                time.sleep(espera)
+        # Sin caso en bloque: fila por fila, para aislar las que no se pueden guardar
+        for registro in lote:
+            if not self._insertar([registro]):
+                logger.error("Registro de auditoría descartado: %r", registro)
+
+    @staticmethod
+    def _insertar(lote: list[dict]) -> bool:
+        db = database.SessionLocal()
+        try:
+            db.bulk_insert_mappings(models.Auditoria, lote)
+            db.commit()
+            return True
+        except Exception:
+            db.rollback()
+            logger.exception("No se pudieron guardar %d registros de auditoría", len(lote))
+            return False
+        finally:
+            db.close()
+
+
+writer = AuditoriaWriter()
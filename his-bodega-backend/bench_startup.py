@@ -0,0 +1,82 @@
+# bench_startup.py
+"""Mide el arranque en frío de un worker.
+
+    python bench_startup.py            # import de main + primera petición
+    python bench_startup.py --top 15   # además, los módulos más lentos según -X importtime
+
+"Primera petición" es el tiempo desde lanzar uvicorn hasta que responde
+GET /openapi.json, que no toca la base de datos.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+
+
+def tiempo_import(repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], cwd=AQUI, check=True)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+
+def modulos_lentos(top: int) -> list[tuple[int, str]]:
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=AQUI, check=True, capture_output=True, text=True
+    ).stderr
+    filas = []
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "cumulative" in linea:
+            continue
+        _, acumulado, modulo = linea[len("import time:"):].split("|")
+        filas.append((int(acumulado), modulo.strip()))
+    filas.sort(reverse=True)
+    return filas[:top]
+
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def tiempo_primera_peticion(timeout: float = 30) -> float:
+    puerto = puerto_libre()
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(puerto), "--log-level", "warning"],
+        cwd=AQUI
+    )
+    try:
+        while time.perf_counter() - inicio < timeout:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{puerto}/openapi.json", timeout=1)
+                return time.perf_counter() - inicio
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError("uvicorn no respondió")
+    finally:
+        proceso.terminate()
+        proceso.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"import main:       {tiempo_import(args.repeticiones) * 1000:.0f} ms (mínimo de {args.repeticiones})")
+    print(f"primera petición:  {min(tiempo_primera_peticion() for _ in range(args.repeticiones)) * 1000:.0f} ms")
+    if args.top:
+        print("\nMódulos más lentos (acumulado, us):")
+        for acumulado, modulo in modulos_lentos(args.top):
+            print(f"  {acumulado:>8}  {modulo}")
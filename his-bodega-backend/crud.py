@@ -1,4 +1,6 @@
 # crud.py
+from decimal import Decimal
+from sqlalchemy.dialects import mysql, sqlite
 from sqlalchemy.orm import Session
 import models
 import schemas
@@ -49,9 +51,75 @@ def delete_insumo(db: Session, insumo_id: int):
         db.commit()
     return db_insumo
 
+BODEGA_CENTRAL = "Central"
+_bodega_central_id = None
+
+class StockInsuficiente(Exception):
+    def __init__(self, disponible):
+        super().__init__(f"Stock insuficiente en la bodega. Stock disponible: {disponible}")
+        self.disponible = disponible
+
+def get_bodega_central_id(db: Session):
+    global _bodega_central_id
+    if _bodega_central_id is None:
+        bodega = db.query(models.Bodega).filter(models.Bodega.nombre == BODEGA_CENTRAL).first()
+        if bodega is None:
+            bodega = models.Bodega(nombre=BODEGA_CENTRAL)
+            db.add(bodega)
+            db.commit()
+        _bodega_central_id = bodega.id
+    return _bodega_central_id
+
+def get_bodegas(db: Session, skip: int = 0, limit: int = 100):
+    return db.query(models.Bodega).offset(skip).limit(limit).all()
+
+def get_bodega(db: Session, bodega_id: int):
+    return db.query(models.Bodega).filter(models.Bodega.id == bodega_id).first()
+
+def create_bodega(db: Session, bodega: schemas.BodegaCreate):
+    db_bodega = models.Bodega(**bodega.dict())
+    db.add(db_bodega)
+    db.commit()
+    db.refresh(db_bodega)
+    return db_bodega
+
+def _asegurar_stock_bodega(db: Session, bodega_id: int, insumo_id: int):
+    """Crea la fila (bodega, insumo) en 0 si no existe, sin error si ya existe.
+    Se inserta antes del SELECT ... FOR UPDATE: bloquear una fila inexistente
+    toma un gap lock y dos transacciones que luego insertan se bloquean entre sí."""
+    valores = dict(bodega_id=bodega_id, insumo_id=insumo_id, stock_actual=Decimal("0"))
+    if db.bind.dialect.name == "mysql":
+        # La asignación a sí misma no cambia nada; sólo evita el error por clave duplicada
+        stmt = mysql.insert(models.StockBodega).values(**valores)\
+            .on_duplicate_key_update(stock_actual=models.StockBodega.stock_actual)
+    else:
+        stmt = sqlite.insert(models.StockBodega).values(**valores).on_conflict_do_nothing()
+    db.execute(stmt)
+
+def ajustar_stock_bodega(db: Session, bodega_id: int, insumo_id: int, delta):
+    """Suma `delta` al stock del insumo en la bodega, bloqueando solo esa fila.
+    No hace commit: se confirma junto con el movimiento."""
+    _asegurar_stock_bodega(db, bodega_id, insumo_id)
+    fila = db.query(models.StockBodega).filter(
+        models.StockBodega.bodega_id == bodega_id,
+        models.StockBodega.insumo_id == insumo_id
+    ).with_for_update().one()
+    nuevo = Decimal(fila.stock_actual or 0) + Decimal(str(delta))
+    if nuevo < 0:
+        raise StockInsuficiente(fila.stock_actual or 0)
+    fila.stock_actual = nuevo
+
 def create_entrada(db: Session, entrada: schemas.EntradaCreate):
+    if entrada.bodega_id is None:
+        entrada.bodega_id = get_bodega_central_id(db)
     db_entrada = models.Entrada(**entrada.dict())
     db.add(db_entrada)
+    try:
+        # Una entrada negativa (corrección) no puede dejar la bodega bajo cero
+        ajustar_stock_bodega(db, entrada.bodega_id, entrada.insumo_id, entrada.cantidad)
+    except StockInsuficiente:
+        db.rollback()
+        raise
     db.commit()
     db.refresh(db_entrada)
     return db_entrada
@@ -60,6 +128,13 @@ def get_entradas(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Entrada).offset(skip).limit(limit).all()
 
 def create_salida(db: Session, salida: schemas.SalidaCreate):
+    if salida.bodega_id is None:
+        salida.bodega_id = get_bodega_central_id(db)
+    try:
+        ajustar_stock_bodega(db, salida.bodega_id, salida.insumo_id, -salida.cantidad)
+    except StockInsuficiente:
+        db.rollback()
+        raise
     db_salida = models.Salida(**salida.dict())
     db.add(db_salida)
     db.commit()
@@ -69,6 +144,61 @@ def create_salida(db: Session, salida: schemas.SalidaCreate):
 def get_salidas(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Salida).offset(skip).limit(limit).all()
 
+def precio_unitario_vigente(db: Session, insumo_id: int, numero_lote: str = None):
+    """Precio de la última compra del lote; si el lote no tiene, el de la última compra del insumo."""
+    query = db.query(models.Entrada.precio_unitario).filter(
+        models.Entrada.insumo_id == insumo_id,
+        models.Entrada.precio_unitario > 0,
+        models.Entrada.transferencia_id.is_(None)
+    )
+    precio = None
+    if numero_lote is not None:
+        precio = query.filter(models.Entrada.numero_lote == numero_lote)\
+            .order_by(models.Entrada.id.desc()).limit(1).scalar()
+    if precio is None:
+        precio = query.order_by(models.Entrada.id.desc()).limit(1).scalar()
+    return precio or 0
+
+def create_transferencia(db: Session, transferencia: schemas.TransferenciaCreate):
+    """Registra la transferencia y su salida/entrada en una sola transacción."""
+    origen, destino = transferencia.bodega_origen_id, transferencia.bodega_destino_id
+    try:
+        # Se bloquean las filas en orden fijo de bodega para evitar deadlocks
+        for bodega_id in sorted((origen, destino)):
+            delta = -transferencia.cantidad if bodega_id == origen else transferencia.cantidad
+            ajustar_stock_bodega(db, bodega_id, transferencia.insumo_id, delta)
+    except StockInsuficiente:
+        db.rollback()
+        raise
+    db_transferencia = models.Transferencia(**transferencia.dict())
+    db.add(db_transferencia)
+    db.flush()
+    movimiento = dict(
+        insumo_id=transferencia.insumo_id,
+        cantidad=transferencia.cantidad,
+        # Se valoriza al precio de origen para que el kardex de destino no quede en 0
+        precio_unitario=precio_unitario_vigente(db, transferencia.insumo_id, transferencia.numero_lote),
+        fecha=transferencia.fecha,
+        usuario_id=transferencia.usuario_id,
+        numero_referencia=f"TRANSFERENCIA {db_transferencia.id}",
+        numero_lote=transferencia.numero_lote,
+        fecha_vencimiento=transferencia.fecha_vencimiento,
+        transferencia_id=db_transferencia.id
+    )
+    db.add(models.Salida(bodega_id=origen, **movimiento))
+    db.add(models.Entrada(bodega_id=destino, **movimiento))
+    db.commit()
+    db.refresh(db_transferencia)
+    return db_transferencia
+
+def get_transferencias(db: Session, bodega_id: int = None, skip: int = 0, limit: int = 100):
+    query = db.query(models.Transferencia)
+    if bodega_id is not None:
+        query = query.filter(
+            (models.Transferencia.bodega_origen_id == bodega_id) | (models.Transferencia.bodega_destino_id == bodega_id)
+        )
+    return query.order_by(models.Transferencia.id.desc()).offset(skip).limit(limit).all()
+
 def create_alerta(db: Session, alerta: schemas.AlertaCreate):
     db_alerta = models.Alerta(**alerta.dict())
     db.add(db_alerta)
@@ -0,0 +1,318 @@
+# idempotencia.py
+"""Deduplicación de peticiones con la cabecera ``Idempotency-Key``.
+
+Una petición mutante (POST/PUT/PATCH/DELETE) que trae ``Idempotency-Key``
+se ejecuta una sola vez: la respuesta 2xx se guarda en la tabla
+``idempotencia`` y en una caché en memoria, y los reintentos con la misma
+clave reciben esa respuesta sin volver a ejecutar la ruta.
+
+Antes de ejecutar, la clave se reserva insertando una fila "en curso"
+(``status_code`` NULL) por clave primaria; así un reintento que llega a otro
+worker mientras la primera petición sigue corriendo recibe 409 en vez de
+ejecutarse de nuevo. Si la petición no termina en 2xx la reserva se borra y
+el cliente puede reintentar. Mientras la ruta corre, la reserva se renueva
+cada ``RESERVA / 3``; sólo vence si el worker muere.
+
+Costo en el camino de escritura: un INSERT+COMMIT antes de la ruta y un
+UPDATE+COMMIT después (dos viajes a MySQL por petición con clave). Las filas
+vencidas las borra una tarea de fondo (``store.iniciar``) en lotes de
+``PURGA_LOTE``, fuera de las peticiones.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from jose import JWTError, jwt
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+import auth
+import database
+import models
+
+CABECERA = "Idempotency-Key"
+METODOS = {"POST", "PUT", "PATCH", "DELETE"}
+TTL = timedelta(hours=24)
+MAX_CACHE = 10000
+PURGA_CADA = timedelta(minutes=10)
+PURGA_LOTE = 1000
+# Vida de una reserva "en curso" sin renovar: pasado este tiempo se asume que el worker murió
+RESERVA = timedelta(minutes=2)
+
+logger = logging.getLogger(__name__)
+
+
+class RespuestaGuardada:
+    __slots__ = ("huella", "status_code", "content_type", "cuerpo", "expira")
+
+    def __init__(self, huella, status_code, content_type, cuerpo, expira):
+        self.huella = huella
+        self.status_code = status_code
+        self.content_type = content_type
+        self.cuerpo = cuerpo
+        self.expira = expira
+
+    def to_response(self) -> Response:
+        return Response(
+            content=self.cuerpo,
+            status_code=self.status_code,
+            media_type=self.content_type,
+            headers={"Idempotent-Replayed": "true"},
+        )
+
+
+class CacheTTL:
+    """LRU acotado en memoria con expiración por entrada."""
+
+    def __init__(self, max_items: int = MAX_CACHE):
+        self.max_items = max_items
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave: str) -> Optional[RespuestaGuardada]:
+        with self._lock:
+            guardada = self._datos.get(clave)
+            if guardada is None:
+                return None
+            if guardada.expira <= datetime.utcnow():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return guardada
+
+    def set(self, clave: str, guardada: RespuestaGuardada) -> None:
+        with self._lock:
+            self._datos[clave] = guardada
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+
+
+class IdempotenciaStore:
+    RESERVADA = "reservada"
+    EN_CURSO = "en_curso"
+    COMPLETA = "completa"
+
+    def __init__(self):
+        self.cache = CacheTTL()
+        self._tarea_purga = None
+
+    def reservar(self, clave: str, metodo: str, ruta: str, huella: str):
+        """Devuelve (estado, fila_guardada). RESERVADA: esta petición debe ejecutarse;
+        EN_CURSO: otra petición con la misma clave aún no termina; COMPLETA: repetir."""
+        ahora = datetime.utcnow()
+        db = database.SessionLocal()
+        try:
+            db.add(models.Idempotencia(
+                clave=clave, metodo=metodo, ruta=ruta[:255], huella=huella,
+                status_code=None, expira=ahora + RESERVA
+            ))
+            try:
+                db.commit()
+                return self.RESERVADA, None
+            except IntegrityError:
+                db.rollback()
+
+            # Una fila vencida (reserva abandonada o respuesta fuera de TTL) se reutiliza
+            tomada = db.query(models.Idempotencia).filter(
+                models.Idempotencia.clave == clave,
+                models.Idempotencia.expira <= ahora
+            ).update({
+                models.Idempotencia.huella: huella,
+                models.Idempotencia.status_code: None,
+                models.Idempotencia.content_type: None,
+                models.Idempotencia.respuesta: None,
+                models.Idempotencia.expira: ahora + RESERVA
+            }, synchronize_session=False)
+            db.commit()
+            if tomada:
+                return self.RESERVADA, None
+
+            fila = db.query(models.Idempotencia).filter(models.Idempotencia.clave == clave).first()
+            if fila is None:
+                # Se purgó entre medio: que el cliente reintente
+                return self.EN_CURSO, None
+            if fila.status_code is None:
+                return self.EN_CURSO, RespuestaGuardada(fila.huella, None, None, b"", fila.expira)
+            guardada = RespuestaGuardada(
+                fila.huella, fila.status_code, fila.content_type,
+                (fila.respuesta or "").encode("utf-8"), fila.expira
+            )
+        finally:
+            db.close()
+        self.cache.set(clave, guardada)
+        return self.COMPLETA, guardada
+
+    def completar(self, clave: str, guardada: RespuestaGuardada) -> None:
+        self.cache.set(clave, guardada)
+        db = database.SessionLocal()
+        try:
+            db.query(models.Idempotencia).filter(models.Idempotencia.clave == clave).update({
+                models.Idempotencia.status_code: guardada.status_code,
+                models.Idempotencia.content_type: guardada.content_type,
+                models.Idempotencia.respuesta: guardada.cuerpo.decode("utf-8"),
+                models.Idempotencia.expira: guardada.expira
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def renovar(self, clave: str) -> None:
+        """Extiende la reserva de una petición que sigue en curso."""
+        db = database.SessionLocal()
+        try:
+            db.query(models.Idempotencia).filter(
+                models.Idempotencia.clave == clave,
+                models.Idempotencia.status_code.is_(None)
+            ).update({models.Idempotencia.expira: datetime.utcnow() + RESERVA}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def liberar(self, clave: str) -> None:
+        """Borra la reserva de una petición que no terminó en 2xx."""
+        db = database.SessionLocal()
+        try:
+            db.query(models.Idempotencia).filter(
+                models.Idempotencia.clave == clave,
+                models.Idempotencia.status_code.is_(None)
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def purgar(self, limite: int = PURGA_LOTE) -> int:
+        """Borra hasta `limite` filas vencidas y devuelve cuántas borró."""
+        db = database.SessionLocal()
+        try:
+            claves = [c for (c,) in db.query(models.Idempotencia.clave).filter(
+                models.Idempotencia.expira <= datetime.utcnow()
+            ).limit(limite).all()]
+            if claves:
+                db.query(models.Idempotencia).filter(
+                    models.Idempotencia.clave.in_(claves)
+                ).delete(synchronize_session=False)
+                db.commit()
+            return len(claves)
+        finally:
+            db.close()
+
+    async def _purgar_periodicamente(self) -> None:
+        while True:
+            await asyncio.sleep(PURGA_CADA.total_seconds())
+            try:
+                while await run_in_threadpool(self.purgar) == PURGA_LOTE:
+                    pass
+            except Exception:
+                logger.exception("No se pudieron purgar las claves de idempotencia vencidas")
+
+    def iniciar(self) -> None:
+        """Arranca la purga periódica en el loop actual (idempotente)."""
+        if self._tarea_purga is None or self._tarea_purga.done():
+            self._tarea_purga = asyncio.get_running_loop().create_task(self._purgar_periodicamente())
+
+    def detener(self) -> None:
+        if self._tarea_purga is not None:
+            self._tarea_purga.cancel()
+            self._tarea_purga = None
+
+
+store = IdempotenciaStore()
+
+
+def _usuario(request: Request) -> str:
+    """`sub` del JWT: la clave sobrevive a un nuevo login o a un token renovado."""
+    esquema, _, token = request.headers.get("authorization", "").partition(" ")
+    if esquema.lower() != "bearer" or not token:
+        return ""
+    try:
+        return jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM]).get("sub") or ""
+    except JWTError:
+        # Token inválido: la ruta responderá 401 y esa respuesta no se guarda
+        return ""
+
+
+def _sha256(*partes) -> str:
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(parte if isinstance(parte, bytes) else str(parte).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+async def _renovar(clave: str) -> None:
+    """Mantiene viva la reserva mientras la ruta corre, por lenta que sea."""
+    while True:
+        await asyncio.sleep(RESERVA.total_seconds() / 3)
+        try:
+            await run_in_threadpool(store.renovar, clave)
+        except Exception:
+            logger.exception("No se pudo renovar la reserva de idempotencia")
+
+
+async def middleware(request: Request, call_next):
+    clave_cliente = request.headers.get(CABECERA)
+    if request.method not in METODOS or not clave_cliente:
+        return await call_next(request)
+
+    # La clave se asocia al usuario autenticado para que no choquen entre clientes
+    clave = _sha256(_usuario(request), request.method, request.url.path, clave_cliente)
+    huella = _sha256(await request.body())
+
+    # Camino rápido: la caché en memoria no toca la base de datos
+    guardada = store.cache.get(clave)
+    if guardada is None:
+        estado, guardada = await run_in_threadpool(store.reservar, clave, request.method, request.url.path, huella)
+    else:
+        estado = store.COMPLETA
+
+    if guardada is not None and guardada.huella != huella:
+        if estado == store.RESERVADA:
+            await run_in_threadpool(store.liberar, clave)
+        return JSONResponse(
+            status_code=422,
+            content={"detail": f"{CABECERA} ya usada con otro cuerpo de petición"}
+        )
+    if estado == store.COMPLETA:
+        return guardada.to_response()
+    if estado == store.EN_CURSO:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": f"Hay una petición en curso con el mismo {CABECERA}"},
+            headers={"Retry-After": "1"}
+        )
+
+    renovacion = asyncio.create_task(_renovar(clave))
+    try:
+        response = await call_next(request)
+    except Exception:
+        await run_in_threadpool(store.liberar, clave)
+        raise
+    finally:
+        renovacion.cancel()
+    if not 200 <= response.status_code < 300:
+        await run_in_threadpool(store.liberar, clave)
+        return response
+
+    cuerpo = b"".join([chunk async for chunk in response.body_iterator])
+    guardada = RespuestaGuardada(
+        huella, response.status_code, response.headers.get("content-type"),
+        cuerpo, datetime.utcnow() + TTL
+    )
+    try:
+        await run_in_threadpool(store.completar, clave, guardada)
+    except Exception:
+        # La operación ya se ejecutó: se devuelve igual la respuesta real. La
+        # reserva queda "en curso" hasta vencer, así que un reintento recibe 409.
+        logger.exception("No se pudo guardar la clave de idempotencia")
+    return Response(
+        content=cuerpo,
+        status_code=response.status_code,
+        headers=dict(response.headers)
+    )
@@ -0,0 +1,140 @@
+# init.py
+"""Crea en la base las tablas que falten y aplica las migraciones pendientes.
+
+La API ya no lo hace al importarse: ejecutar una vez por despliegue (o
+después de agregar modelos), antes de levantar los workers:
+
+    python init.py
+"""
+import re
+
+from sqlalchemy import inspect, text
+
+import crud
+import database
+import models
+
+TAMANO_LOTE = 5000
+_ID_EN_DETALLE = re.compile(r"\bID: (\d+)")
+# Acciones cuyo `detalle` trae el id del insumo ("ID: 5" o "Insumo ID: 5")
+ACCIONES_INSUMO = {"ACTUALIZAR INSUMO", "ELIMINAR INSUMO", "REGISTRAR ENTRADA", "REGISTRAR SALIDA"}
+# Índices de la paginación por id, reemplazados por los de (fecha, id)
+INDICES_AUDITORIA_VIEJOS = ("ix_auditoria_usuario_id_id", "ix_auditoria_accion_id", "ix_auditoria_entidad_id")
+
+
+def crear_tablas():
+    models.Base.metadata.create_all(bind=database.engine)
+
+
+def _agregar_columnas(modelo, nombres):
+    """Agrega a una tabla existente las columnas nuevas del modelo, sus claves
+    foráneas y sus índices."""
+    tabla = modelo.__table__
+    inspector = inspect(database.engine)
+    columnas = {c["name"] for c in inspector.get_columns(tabla.name)}
+    indices = {i["name"] for i in inspector.get_indexes(tabla.name)}
+    con_fk = {col for fk in inspector.get_foreign_keys(tabla.name) for col in fk["constrained_columns"]}
+
+    with database.engine.begin() as conn:
+        for nombre in nombres:
+            if nombre not in columnas:
+                tipo = tabla.c[nombre].type.compile(dialect=database.engine.dialect)
+                conn.execute(text(f"ALTER TABLE {tabla.name} ADD COLUMN {nombre} {tipo}"))
+            if nombre not in con_fk:
+                for fk in tabla.c[nombre].foreign_keys:
+                    conn.execute(text(
+                        f"ALTER TABLE {tabla.name} ADD CONSTRAINT fk_{tabla.name}_{nombre} "
+                        f"FOREIGN KEY ({nombre}) REFERENCES {fk.column.table.name} ({fk.column.name})"
+                    ))
+    for indice in tabla.indexes:
+        if indice.name not in indices:
+            indice.create(bind=database.engine)
+
+
+def migrar_idempotencia():
+    """status_code pasó a admitir NULL (reserva en curso)."""
+    columnas = {c["name"]: c for c in inspect(database.engine).get_columns("idempotencia")}
+    if not columnas["status_code"]["nullable"]:
+        with database.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE idempotencia MODIFY status_code INTEGER NULL"))
+
+
+def migrar_insumos():
+    """Agrega insumos.updated_at. En MySQL se define con ON UPDATE para que
+    también la actualicen los triggers de stock, que el ORM no ve."""
+    _agregar_columnas(models.Insumo, ("updated_at",))
+    if database.engine.dialect.name == "mysql":
+        with database.engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE insumos MODIFY updated_at TIMESTAMP NOT NULL "
+                "DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"
+            ))
+
+
+def migrar_auditoria():
+    """Agrega entidad_tipo/entidad_id e índices a una tabla auditoria existente
+    y rellena esas columnas a partir del texto de `detalle`."""
+    _agregar_columnas(models.Auditoria, ("entidad_tipo", "entidad_id"))
+    indices = {i["name"] for i in inspect(database.engine).get_indexes("auditoria")}
+    with database.engine.begin() as conn:
+        for nombre in INDICES_AUDITORIA_VIEJOS:
+            if nombre in indices:
+                conn.execute(text(f"DROP INDEX {nombre} ON auditoria"))
+
+    # Relleno por lotes de id para no bloquear la tabla completa
+    db = database.SessionLocal()
+    try:
+        ultimo_id = 0
+        while True:
+            filas = db.query(models.Auditoria.id, models.Auditoria.accion, models.Auditoria.detalle)\
+                .filter(models.Auditoria.id > ultimo_id, models.Auditoria.entidad_id.is_(None))\
+                .order_by(models.Auditoria.id)\
+                .limit(TAMANO_LOTE)\
+                .all()
+            if not filas:
+                break
+            cambios = []
+            for fila in filas:
+                match = _ID_EN_DETALLE.search(fila.detalle or "")
+                if match and fila.accion in ACCIONES_INSUMO:
+                    cambios.append({"id": fila.id, "entidad_tipo": "insumo", "entidad_id": int(match.group(1))})
+            if cambios:
+                db.bulk_update_mappings(models.Auditoria, cambios)
+                db.commit()
+            ultimo_id = filas[-1].id
+    finally:
+        db.close()
+
+
+def migrar_bodegas():
+    """Pasa una base de una sola bodega al esquema multi-bodega: los movimientos
+    sin bodega quedan en la bodega central y su stock se toma de insumos.stock_actual."""
+    for modelo in (models.Entrada, models.Salida):
+        _agregar_columnas(modelo, ("bodega_id", "transferencia_id"))
+
+    db = database.SessionLocal()
+    try:
+        central_id = crud.get_bodega_central_id(db)
+        for modelo in (models.Entrada, models.Salida):
+            db.query(modelo).filter(modelo.bodega_id.is_(None))\
+                .update({modelo.bodega_id: central_id}, synchronize_session=False)
+        existentes = db.query(models.StockBodega.insumo_id).filter(models.StockBodega.bodega_id == central_id)
+        faltantes = db.query(models.Insumo.id, models.Insumo.stock_actual)\
+            .filter(models.Insumo.id.notin_(existentes))\
+            .all()
+        db.bulk_insert_mappings(models.StockBodega, [
+            {"bodega_id": central_id, "insumo_id": insumo_id, "stock_actual": stock_actual or 0}
+            for insumo_id, stock_actual in faltantes
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    crear_tablas()
+    migrar_idempotencia()
+    migrar_insumos()
+    migrar_auditoria()
+    migrar_bodegas()
+    print(f"Tablas verificadas: {', '.join(sorted(models.Base.metadata.tables))}")
@@ -1,18 +1,79 @@
 # main.py
-from fastapi import FastAPI, Depends, HTTPException, status, Response
+from fastapi import FastAPI, Depends, HTTPException, status, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func 
+from sqlalchemy import func, and_, or_
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import timedelta, date
+from contextlib import asynccontextmanager
+from datetime import timedelta, date, datetime
 from typing import Optional
+import asyncio
+import logging
+import os
 import models
 import schemas
 import crud
 import auth
 import database
+import realtime
+import idempotencia
+import auditoria
 
-app = FastAPI(title="HIS-Bodega", description="Sistema de Gestión de Inventario")
+# pronostico y vencimiento (pandas) se importan dentro de sus endpoints para no
+# pagar ese costo en el arranque de cada worker.
+
+logger = logging.getLogger(__name__)
+
+# Índice de stock en memoria (stock_index.py). Trae NumPy, así que se importa
+# recién al cargarlo en segundo plano y nunca si está desactivado.
+STOCK_INDEX_HABILITADO = os.environ.get("HIS_STOCK_INDEX", "1") != "0"
+_indice_stock = None
+
+def cargar_indice_stock():
+    global _indice_stock
+    import stock_index
+    db = database.SessionLocal()
+    try:
+        stock_index.indice.cargar(db)
+        _indice_stock = stock_index.indice
+    except Exception:
+        # Sin índice las rutas consultan MySQL directamente
+        logger.exception("No se pudo cargar el índice de stock")
+    finally:
+        db.close()
+
+def indice_stock():
+    """El índice ya cargado, o None (desactivado o todavía cargando): la ruta va a MySQL."""
+    return _indice_stock
+
+def indice_registrar(db, insumo_id):
+    if _indice_stock is not None:
+        _indice_stock.registrar_movimiento(db, insumo_id)
+
+def indice_requerido():
+    if _indice_stock is None:
+        raise HTTPException(status_code=503, detail="Índice de stock no disponible")
+    return _indice_stock
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Las tablas ya no se crean al importar: ver init.py
+    realtime.hub.iniciar()
+    auditoria.writer.iniciar()
+    idempotencia.store.iniciar()
+    if STOCK_INDEX_HABILITADO:
+        # En segundo plano, para que el worker acepte peticiones sin esperar a la base
+        asyncio.get_running_loop().run_in_executor(None, cargar_indice_stock)
+    yield
+    idempotencia.store.detener()
+    auditoria.writer.detener()
+
+app = FastAPI(title="HIS-Bodega", description="Sistema de Gestión de Inventario", lifespan=lifespan)
+
+# Idempotency-Key en POST/PUT/PATCH/DELETE (reintentos de los lectores en Wi-Fi inestable).
+# Se registra antes que CORS para que las respuestas repetidas también lleven sus cabeceras.
+app.middleware("http")(idempotencia.middleware)
 
 # Habilitar CORS
 app.add_middleware(
@@ -23,18 +84,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Crear tablas
-models.Base.metadata.create_all(bind=database.engine)
-
-def registrar_auditoria(db, usuario_id, accion, detalle="", ip_address=""):
-    auditoria = models.Auditoria(
-        usuario_id=usuario_id,
-        accion=accion,
-        detalle=detalle,
-        ip_address=ip_address
-    )
-    db.add(auditoria)
-    db.commit()
+def registrar_auditoria(db, usuario_id, accion, detalle="", ip_address="", entidad_tipo=None, entidad_id=None):
+    # Se encola y lo inserta el hilo de auditoria.writer (ver auditoria.py)
+    auditoria.writer.registrar(db, usuario_id, accion, detalle, ip_address, entidad_tipo, entidad_id)
 
 @app.post("/auth/token", response_model=schemas.Token)
 def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
@@ -66,7 +118,8 @@ def read_users_me(current_user: schemas.Usuario = Depends(auth.get_current_user)
 @app.post("/insumos/", response_model=schemas.Insumo, status_code=201)
 def create_insumo(insumo: schemas.InsumoCreate, current_user: schemas.Usuario = Depends(auth.get_current_admin_user), db: Session = Depends(database.get_db)):
     db_insumo = crud.create_insumo(db=db, insumo=insumo)
-    registrar_auditoria(db, current_user.id, "CREAR INSUMO", f"Nombre: {insumo.nombre}")
+    registrar_auditoria(db, current_user.id, "CREAR INSUMO", f"Nombre: {insumo.nombre}", entidad_tipo="insumo", entidad_id=db_insumo.id)
+    indice_registrar(db, db_insumo.id)
     return db_insumo
 
 # ✅ ENDPOINT ACTUALIZADO: Incluye la especialidad
@@ -89,7 +142,8 @@ def update_insumo(insumo_id: int, insumo: schemas.InsumoCreate, current_user: sc
     db_insumo = crud.update_insumo(db, insumo_id=insumo_id, insumo=insumo)
     if db_insumo is None:
         raise HTTPException(status_code=404, detail="Insumo not found")
-    registrar_auditoria(db, current_user.id, "ACTUALIZAR INSUMO", f"ID: {insumo_id}, Nombre: {insumo.nombre}")
+    registrar_auditoria(db, current_user.id, "ACTUALIZAR INSUMO", f"ID: {insumo_id}, Nombre: {insumo.nombre}", entidad_tipo="insumo", entidad_id=insumo_id)
+    indice_registrar(db, insumo_id)
     return db_insumo
 
 @app.delete("/insumos/{insumo_id}", response_model=schemas.Insumo)
@@ -97,7 +151,8 @@ def delete_insumo(insumo_id: int, current_user: schemas.Usuario = Depends(auth.g
     db_insumo = crud.delete_insumo(db, insumo_id=insumo_id)
     if db_insumo is None:
         raise HTTPException(status_code=404, detail="Insumo not found")
-    registrar_auditoria(db, current_user.id, "ELIMINAR INSUMO", f"ID: {insumo_id}")
+    registrar_auditoria(db, current_user.id, "ELIMINAR INSUMO", f"ID: {insumo_id}", entidad_tipo="insumo", entidad_id=insumo_id)
+    indice_registrar(db, insumo_id)
     return db_insumo
 
 # CRUD para Entradas
@@ -105,8 +160,21 @@ def delete_insumo(insumo_id: int, current_user: schemas.Usuario = Depends(auth.g
 def create_entrada(entrada: schemas.EntradaCreate, current_user: schemas.Usuario = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
     if entrada.usuario_id is None:
         entrada.usuario_id = current_user.id
-    db_entrada = crud.create_entrada(db=db, entrada=entrada)
-    registrar_auditoria(db, current_user.id, "REGISTRAR ENTRADA", f"Insumo ID: {entrada.insumo_id}, Cantidad: {entrada.cantidad}")
+    if entrada.bodega_id is not None and crud.get_bodega(db, entrada.bodega_id) is None:
+        raise HTTPException(status_code=404, detail="Bodega no encontrada")
+    try:
+        db_entrada = crud.create_entrada(db=db, entrada=entrada)
+    except crud.StockInsuficiente as e:
+        raise HTTPException(status_code=400, detail=f"{e}, solicitado: {entrada.cantidad}")
+    registrar_auditoria(db, current_user.id, "REGISTRAR ENTRADA", f"Insumo ID: {entrada.insumo_id}, Cantidad: {entrada.cantidad}", entidad_tipo="insumo", entidad_id=entrada.insumo_id)
+    indice_registrar(db, entrada.insumo_id)
+    indice = indice_stock()
+    fila = indice.fila(entrada.insumo_id) if indice is not None else None
+    if fila is not None:
+        especialidad_id = fila[2]
+    else:
+        especialidad_id = db.query(models.Insumo.especialidad_id).filter(models.Insumo.id == entrada.insumo_id).scalar()
+    realtime.hub.emit_movimiento(entrada, especialidad_id, 1)
     return db_entrada
 
 @app.get("/entradas/", response_model=list[schemas.Entrada])
@@ -125,18 +193,82 @@ def read_entradas(skip: int = 0, limit: int = 100, db: Session = Depends(databas
 def create_salida(salida: schemas.SalidaCreate, current_user: schemas.Usuario = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
     if salida.usuario_id is None:
         salida.usuario_id = current_user.id
-    
-    # Verificar stock disponible
-    insumo = db.query(models.Insumo).filter(models.Insumo.id == salida.insumo_id).first()
-    if not insumo:
+    if salida.bodega_id is not None and crud.get_bodega(db, salida.bodega_id) is None:
+        raise HTTPException(status_code=404, detail="Bodega no encontrada")
+    
+    # Pre-validación con el índice en memoria (eventualmente consistente, puede
+    # tener hasta INTERVALO_VERIFICACION de atraso). La verificación definitiva
+    # la hace crud.create_salida con la fila (bodega, insumo) bloqueada.
+    indice = indice_stock()
+    fila = None
+    if indice is not None:
+        indice.sincronizar(db)
+        fila = indice.fila(salida.insumo_id)
+    if fila is not None:
+        stock_actual, _, especialidad_id = fila
+    else:
+        insumo = db.query(models.Insumo).filter(models.Insumo.id == salida.insumo_id).first()
+        if not insumo:
+            raise HTTPException(status_code=404, detail="Insumo no encontrado")
+        stock_actual, especialidad_id = insumo.stock_actual, insumo.especialidad_id
+    
+    if stock_actual < salida.cantidad:
+        raise HTTPException(status_code=400, detail=f"Stock insuficiente. Stock disponible: {stock_actual}, solicitado: {salida.cantidad}")
+    
+    # Verificación definitiva, con la fila (bodega, insumo) bloqueada
+    try:
+        db_salida = crud.create_salida(db=db, salida=salida)
+    except crud.StockInsuficiente as e:
+        raise HTTPException(status_code=400, detail=f"{e}, solicitado: {salida.cantidad}")
+    registrar_auditoria(db, current_user.id, "REGISTRAR SALIDA", f"Insumo ID: {salida.insumo_id}, Cantidad: {salida.cantidad}", entidad_tipo="insumo", entidad_id=salida.insumo_id)
+    indice_registrar(db, salida.insumo_id)
+    realtime.hub.emit_movimiento(salida, especialidad_id, -1)
+    return db_salida
+
+# Bodegas y transferencias
+@app.get("/bodegas/", response_model=list[schemas.Bodega])
+def read_bodegas(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+    return crud.get_bodegas(db, skip=skip, limit=limit)
+
+@app.post("/bodegas/", response_model=schemas.Bodega, status_code=201)
+def create_bodega(bodega: schemas.BodegaCreate, current_user: schemas.Usuario = Depends(auth.get_current_admin_user), db: Session = Depends(database.get_db)):
+    db_bodega = crud.create_bodega(db=db, bodega=bodega)
+    registrar_auditoria(db, current_user.id, "CREAR BODEGA", f"Nombre: {bodega.nombre}", entidad_tipo="bodega", entidad_id=db_bodega.id)
+    return db_bodega
+
+@app.post("/transferencias/", response_model=schemas.Transferencia, status_code=201)
+def create_transferencia(transferencia: schemas.TransferenciaCreate, current_user: schemas.Usuario = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    """Mueve stock entre bodegas: registra una salida en el origen y una entrada en el destino de forma atómica."""
+    if transferencia.usuario_id is None:
+        transferencia.usuario_id = current_user.id
+    if transferencia.bodega_origen_id == transferencia.bodega_destino_id:
+        raise HTTPException(status_code=400, detail="La bodega de origen y destino deben ser distintas")
+    if transferencia.cantidad <= 0:
+        raise HTTPException(status_code=400, detail="La cantidad debe ser mayor a 0")
+    for bodega_id in (transferencia.bodega_origen_id, transferencia.bodega_destino_id):
+        if crud.get_bodega(db, bodega_id) is None:
+            raise HTTPException(status_code=404, detail="Bodega no encontrada")
+    insumo = crud.get_insumo(db, transferencia.insumo_id)
+    if insumo is None:
         raise HTTPException(status_code=404, detail="Insumo no encontrado")
     
-    if insumo.stock_actual < salida.cantidad:
-        raise HTTPException(status_code=400, detail=f"Stock insuficiente. Stock disponible: {insumo.stock_actual}, solicitado: {salida.cantidad}")
-    
-    db_salida = crud.create_salida(db=db, salida=salida)
-    registrar_auditoria(db, current_user.id, "REGISTRAR SALIDA", f"Insumo ID: {salida.insumo_id}, Cantidad: {salida.cantidad}")
-    return db_salida
+    try:
+        db_transferencia = crud.create_transferencia(db=db, transferencia=transferencia)
+    except crud.StockInsuficiente as e:
+        raise HTTPException(status_code=400, detail=f"{e}, solicitado: {transferencia.cantidad}")
+    registrar_auditoria(
+        db, current_user.id, "REGISTRAR TRANSFERENCIA",
+        f"Insumo ID: {transferencia.insumo_id}, Cantidad: {transferencia.cantidad}, "
+        f"Bodega {transferencia.bodega_origen_id} -> {transferencia.bodega_destino_id}",
+        entidad_tipo="insumo", entidad_id=transferencia.insumo_id
+    )
+    indice_registrar(db, transferencia.insumo_id)
+    realtime.hub.emit_transferencia(transferencia, insumo.especialidad_id)
+    return db_transferencia
+
+@app.get("/transferencias/", response_model=list[schemas.Transferencia])
+def read_transferencias(bodega_id: Optional[int] = None, skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+    return crud.get_transferencias(db, bodega_id=bodega_id, skip=skip, limit=limit)
 
 @app.get("/salidas/", response_model=list[schemas.Salida])
 def read_salidas(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
@@ -145,7 +277,10 @@ def read_salidas(skip: int = 0, limit: int = 100, db: Session = Depends(database
 # CRUD para Alertas
 @app.post("/alertas/", response_model=schemas.Alerta, status_code=201)
 def create_alerta(alerta: schemas.AlertaCreate, current_user: schemas.Usuario = Depends(auth.get_current_admin_user), db: Session = Depends(database.get_db)):
-    return crud.create_alerta(db=db, alerta=alerta)
+    db_alerta = crud.create_alerta(db=db, alerta=alerta)
+    especialidad_id = db.query(models.Insumo.especialidad_id).filter(models.Insumo.id == alerta.insumo_id).scalar()
+    realtime.hub.emit_alerta(db_alerta, especialidad_id)
+    return db_alerta
 
 @app.get("/alertas/", response_model=list[schemas.Alerta])
 def read_alertas(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
@@ -180,10 +315,16 @@ def read_alertas(skip: int = 0, limit: int = 100, db: Session = Depends(database
 @app.post("/alertas/automáticas", response_model=list[schemas.Alerta])
 def generate_automatic_alerts(db: Session = Depends(database.get_db)):
     """Genera alertas automáticas para insumos con stock bajo"""
-    insumos_bajo_stock = db.query(models.Insumo).filter(
-        models.Insumo.stock_actual < models.Insumo.stock_minimo,
-        models.Insumo.stock_minimo > 0
-    ).all()
+    indice = indice_stock()
+    if indice is not None:
+        indice.sincronizar(db)
+        ids = indice.bajo_minimo().tolist()
+        insumos_bajo_stock = db.query(models.Insumo).filter(models.Insumo.id.in_(ids)).all() if ids else []
+    else:
+        insumos_bajo_stock = db.query(models.Insumo).filter(
+            models.Insumo.stock_actual < models.Insumo.stock_minimo,
+            models.Insumo.stock_minimo > 0
+        ).all()
     
     alertas_creadas = []
     for insumo in insumos_bajo_stock:
@@ -200,17 +341,25 @@ def generate_automatic_alerts(db: Session = Depends(database.get_db)):
                 fecha=date.today()
             )
             db.add(alerta)
-            alertas_creadas.append(alerta)
+            alertas_creadas.append((alerta, insumo.especialidad_id))
     
     db.commit()
-    return alertas_creadas
+    for alerta, especialidad_id in alertas_creadas:
+        realtime.hub.emit_alerta(alerta, especialidad_id)
+    return [alerta for alerta, _ in alertas_creadas]
 
 # Kardex
 @app.get("/kardex/{insumo_id}", response_model=dict)
-def get_kardex(insumo_id: int, db: Session = Depends(database.get_db)):
-    """Obtiene el kardex de un insumo con cálculos de valor total"""
-    entradas = db.query(models.Entrada).filter(models.Entrada.insumo_id == insumo_id).all()
-    salidas = db.query(models.Salida).filter(models.Salida.insumo_id == insumo_id).all()
+def get_kardex(insumo_id: int, bodega_id: Optional[int] = None, db: Session = Depends(database.get_db)):
+    """Obtiene el kardex de un insumo con cálculos de valor total.
+    Con `bodega_id` se limita a los movimientos de esa bodega (incluye transferencias)."""
+    entradas_query = db.query(models.Entrada).filter(models.Entrada.insumo_id == insumo_id)
+    salidas_query = db.query(models.Salida).filter(models.Salida.insumo_id == insumo_id)
+    if bodega_id is not None:
+        entradas_query = entradas_query.filter(models.Entrada.bodega_id == bodega_id)
+        salidas_query = salidas_query.filter(models.Salida.bodega_id == bodega_id)
+    entradas = entradas_query.all()
+    salidas = salidas_query.all()
     
     movimientos = []
     for e in entradas:
@@ -224,7 +373,9 @@ def get_kardex(insumo_id: int, db: Session = Depends(database.get_db)):
             "remitente_destinatario": e.remitente_destinatario,
             "numero_lote": e.numero_lote,
             "fecha_vencimiento": e.fecha_vencimiento,
-            "usuario_id": e.usuario_id
+            "usuario_id": e.usuario_id,
+            "bodega_id": e.bodega_id,
+            "transferencia_id": e.transferencia_id
         })
     for s in salidas:
         movimientos.append({
@@ -237,7 +388,9 @@ def get_kardex(insumo_id: int, db: Session = Depends(database.get_db)):
             "remitente_destinatario": s.remitente_destinatario,
             "numero_lote": None,
             "fecha_vencimiento": None,
-            "usuario_id": s.usuario_id
+            "usuario_id": s.usuario_id,
+            "bodega_id": s.bodega_id,
+            "transferencia_id": s.transferencia_id
         })
     
     # Ordenar por fecha
@@ -270,12 +423,23 @@ def get_kardex(insumo_id: int, db: Session = Depends(database.get_db)):
 
 # Reporte de stock
 @app.get("/reporte-stock", response_model=list)
-def get_stock_report(db: Session = Depends(database.get_db)):
+def get_stock_report(bodega_id: Optional[int] = None, db: Session = Depends(database.get_db)):
+    """Stock por insumo. Sin `bodega_id` incluye el desglose `stock_por_bodega`;
+    con `bodega_id`, `stock_actual` es el de esa bodega."""
     insumos = db.query(models.Insumo).all()
+    
+    # Stock por bodega en una sola consulta
+    stock_bodega_query = db.query(models.StockBodega)
+    if bodega_id is not None:
+        stock_bodega_query = stock_bodega_query.filter(models.StockBodega.bodega_id == bodega_id)
+    stock_por_bodega = {}
+    for fila in stock_bodega_query.all():
+        stock_por_bodega.setdefault(fila.insumo_id, {})[fila.bodega_id] = float(fila.stock_actual)
+    
     reporte = []
     for i in insumos:
         alertas = db.query(models.Alerta).filter(models.Alerta.insumo_id == i.id).all()
-        reporte.append({
+        item = {
             "insumo_id": i.id,
             "nombre": i.nombre,
             "descripcion": i.descripcion,
@@ -283,7 +447,13 @@ def get_stock_report(db: Session = Depends(database.get_db)):
             "stock_actual": float(i.stock_actual),
             "stock_minimo": float(i.stock_minimo),
             "alertas": [a.mensaje for a in alertas]
-        })
+        }
+        if bodega_id is not None:
+            item["bodega_id"] = bodega_id
+            item["stock_actual"] = stock_por_bodega.get(i.id, {}).get(bodega_id, 0.0)
+        else:
+            item["stock_por_bodega"] = stock_por_bodega.get(i.id, {})
+        reporte.append(item)
     return reporte
 
 @app.get("/insumos/{insumo_id}/lotes-disponibles")
@@ -292,9 +462,11 @@ def get_lotes_disponibles(insumo_id: int, db: Session = Depends(database.get_db)
     incluyendo el precio unitario y calculando correctamente el stock disponible por lote."""
     
     # Obtener todas las entradas para este insumo con sus precios
+    # Las entradas por transferencia repiten lotes ya ingresados en otra bodega
     entradas = db.query(models.Entrada).filter(
         models.Entrada.insumo_id == insumo_id,
-        models.Entrada.cantidad > 0
+        models.Entrada.cantidad > 0,
+        models.Entrada.transferencia_id.is_(None)
     ).all()
     
     # Obtener todas las salidas para este insumo (asumiendo que las salidas registran el lote)
@@ -403,10 +575,153 @@ def generate_vencimiento_alerts(dias: int = 30, db: Session = Depends(database.g
                     fecha=date.today()
                 )
                 db.add(alerta)
-                alertas_creadas.append(alerta)
+                alertas_creadas.append((alerta, insumo.especialidad_id))
     
     db.commit()
-    return alertas_creadas
+    for alerta, especialidad_id in alertas_creadas:
+        realtime.hub.emit_alerta(alerta, especialidad_id)
+    return [alerta for alerta, _ in alertas_creadas]
+
+# Consulta de auditoría (solo admin), paginada por id descendente
+@app.get("/auditoria", response_model=schemas.AuditoriaPagina)
+def read_auditoria(
+    usuario_id: Optional[int] = None,
+    accion: Optional[str] = None,
+    entidad_tipo: Optional[str] = None,
+    entidad_id: Optional[int] = None,
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    current_user: schemas.Usuario = Depends(auth.get_current_admin_user),
+    db: Session = Depends(database.get_db)
+):
+    """
+    Devuelve los registros más recientes primero. Para la página siguiente,
+    repetir la consulta con `cursor` = `siguiente_cursor` de la respuesta.
+    """
+    limit = max(1, min(limit, 500))
+    if cursor is not None:
+        # El cursor es "<fecha ISO>_<id>" del último registro de la página anterior
+        try:
+            fecha_cursor, _, id_cursor = cursor.rpartition("_")
+            fecha_cursor, id_cursor = datetime.fromisoformat(fecha_cursor), int(id_cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="cursor inválido")
+    query = db.query(models.Auditoria)
+    if usuario_id is not None:
+        query = query.filter(models.Auditoria.usuario_id == usuario_id)
+    if accion is not None:
+        query = query.filter(models.Auditoria.accion == accion)
+    if entidad_tipo is not None:
+        query = query.filter(models.Auditoria.entidad_tipo == entidad_tipo)
+    if entidad_id is not None:
+        query = query.filter(models.Auditoria.entidad_id == entidad_id)
+    if fecha_inicio is not None:
+        query = query.filter(models.Auditoria.fecha >= datetime.combine(fecha_inicio, datetime.min.time()))
+    if fecha_fin is not None:
+        query = query.filter(models.Auditoria.fecha < datetime.combine(fecha_fin + timedelta(days=1), datetime.min.time()))
+    if cursor is not None:
+        # Keyset sobre (fecha, id): el rango de fechas y el cursor usan el mismo índice
+        query = query.filter(or_(
+            models.Auditoria.fecha < fecha_cursor,
+            and_(models.Auditoria.fecha == fecha_cursor, models.Auditoria.id < id_cursor)
+        ))
+    
+    # Se pide un registro extra para saber si hay página siguiente
+    registros = query.order_by(models.Auditoria.fecha.desc(), models.Auditoria.id.desc()).limit(limit + 1).all()
+    siguiente_cursor = None
+    if len(registros) > limit:
+        ultimo = registros[limit - 1]
+        siguiente_cursor = f"{ultimo.fecha.isoformat()}_{ultimo.id}"
+    return {"items": registros[:limit], "siguiente_cursor": siguiente_cursor}
+
+# Notificaciones en tiempo real (reemplazan el polling de /alertas/ e /insumos/)
+@app.websocket("/ws/stock")
+async def ws_stock(websocket: WebSocket, especialidad_ids: Optional[str] = None, insumo_ids: Optional[str] = None, bodega_ids: Optional[str] = None):
+    """Envía, cada tick, los deltas de stock, alertas nuevas y cambios de lote.
+    Filtros opcionales: ?especialidad_ids=1,2&insumo_ids=10,11&bodega_ids=3"""
+    await websocket.accept()
+    try:
+        filtros = realtime.parse_ids(especialidad_ids), realtime.parse_ids(insumo_ids), realtime.parse_ids(bodega_ids)
+    except ValueError as e:
+        # 1008 = policy violation: el cliente no debe reconectar con los mismos filtros
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
+    suscripcion = await realtime.hub.suscribir(*filtros)
+
+    async def esperar_cierre():
+        # El cliente no envía nada: sólo se lee para enterarse del cierre
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    # Sin esto, una pestaña cerrada con un filtro poco activo quedaría suscrita
+    # hasta el próximo evento que le corresponda
+    cierre = asyncio.create_task(esperar_cierre())
+    try:
+        while True:
+            siguiente = asyncio.create_task(suscripcion.cola.get())
+            listos, _ = await asyncio.wait({siguiente, cierre}, return_when=asyncio.FIRST_COMPLETED)
+            if cierre in listos:
+                siguiente.cancel()
+                break
+            await websocket.send_json(siguiente.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        cierre.cancel()
+        realtime.hub.cancelar(suscripcion)
+
+@app.get("/sse/stock")
+async def sse_stock(especialidad_ids: Optional[str] = None, insumo_ids: Optional[str] = None, bodega_ids: Optional[str] = None):
+    """Alternativa Server-Sent Events a /ws/stock con los mismos filtros."""
+    try:
+        filtros = realtime.parse_ids(especialidad_ids), realtime.parse_ids(insumo_ids), realtime.parse_ids(bodega_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    suscripcion = await realtime.hub.suscribir(*filtros)
+
+    async def eventos():
+        try:
+            while True:
+                mensaje = await suscripcion.cola.get()
+                yield realtime.formato_sse(mensaje)
+        finally:
+            realtime.hub.cancelar(suscripcion)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# Índice de stock en memoria
+@app.get("/stock/")
+def read_stock(ids: str, db: Session = Depends(database.get_db)):
+    """Stock actual de los insumos indicados (?ids=1,2,3)."""
+    indice = indice_requerido()
+    try:
+        insumo_ids = realtime.parse_ids(ids) or []
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    indice.sincronizar(db)
+    return indice.stock_de(insumo_ids)
+
+@app.get("/stock/bajo-minimo")
+def read_stock_bajo_minimo(db: Session = Depends(database.get_db)):
+    indice = indice_requerido()
+    indice.sincronizar(db)
+    return indice.bajo_minimo().tolist()
+
+@app.get("/stock/por-especialidad")
+def read_stock_por_especialidad(db: Session = Depends(database.get_db)):
+    indice = indice_requerido()
+    indice.sincronizar(db)
+    return indice.totales_por_especialidad()
+
+@app.get("/stock/indice")
+def read_stock_indice():
+    """Estado del índice: cantidad de insumos, memoria usada y versión."""
+    indice = indice_stock()
+    if indice is None:
+        return {'habilitado': STOCK_INDEX_HABILITADO, 'cargado': False}
+    return {'habilitado': True, **indice.estado()}
 
 # Endpoint para obtener especialidades
 @app.get("/especialidades/", response_model=list[schemas.Especialidad])
@@ -418,11 +733,14 @@ def read_especialidades(skip: int = 0, limit: int = 100, db: Session = Depends(d
 def get_consumo_por_especialidad(
     fecha_inicio: Optional[date] = None,
     fecha_fin: Optional[date] = None,
+    bodega_id: Optional[int] = None,
     db: Session = Depends(database.get_db)
 ):
     """
     Obtiene el consumo de insumos por especialidad en un rango de fechas.
     Si no se especifican fechas, devuelve el último mes.
+    Con `bodega_id` solo cuenta las salidas de esa bodega. Las transferencias
+    entre bodegas no son consumo y se excluyen.
     """
     from datetime import date, timedelta
     
@@ -433,7 +751,7 @@ def get_consumo_por_especialidad(
         fecha_inicio = fecha_fin - timedelta(days=30)
     
     # Query principal
-    resultados = db.query(
+    query = db.query(
         models.Especialidad.nombre.label('especialidad'),
         models.Insumo.nombre.label('insumo'),
         func.sum(models.Salida.cantidad).label('cantidad_total'),
@@ -443,7 +761,10 @@ def get_consumo_por_especialidad(
      .join(models.Especialidad, models.Insumo.especialidad_id == models.Especialidad.id)\
      .filter(models.Salida.fecha >= fecha_inicio)\
      .filter(models.Salida.fecha <= fecha_fin)\
-     .group_by(models.Especialidad.nombre, models.Insumo.nombre)\
+     .filter(models.Salida.transferencia_id.is_(None))
+    if bodega_id is not None:
+        query = query.filter(models.Salida.bodega_id == bodega_id)
+    resultados = query.group_by(models.Especialidad.nombre, models.Insumo.nombre)\
      .order_by(models.Especialidad.nombre, func.sum(models.Salida.cantidad).desc())\
      .all()
     
@@ -474,5 +795,74 @@ def get_consumo_por_especialidad(
             'fecha_inicio': fecha_inicio,
             'fecha_fin': fecha_fin
         },
+        'bodega_id': bodega_id,
         'especialidades': reporte
     }
+
+@app.get("/reportes/reabastecimiento")
+def get_reabastecimiento(
+    metodo: str = "media_movil",
+    dias_historia: int = 90,
+    ventana: int = 30,
+    alpha: float = 0.3,
+    lead_time_dias: float = 7,
+    periodo_revision_dias: float = 7,
+    nivel_servicio: float = 0.95,
+    solo_reabastecer: bool = True,
+    db: Session = Depends(database.get_db)
+):
+    """
+    Pronostica la demanda diaria de cada insumo a partir de las salidas y
+    calcula punto de reorden, cantidad sugerida y riesgo de quiebre antes
+    de la próxima entrega (lead time).
+    metodo: 'media_movil' (últimos `ventana` días) o 'suavizado' (exponencial, `alpha`).
+    """
+    import pronostico
+    
+    if metodo not in pronostico.METODOS:
+        raise HTTPException(status_code=400, detail=f"Método inválido. Opciones: {', '.join(pronostico.METODOS)}")
+    if dias_historia < 1 or ventana < 1 or not 0 < alpha <= 1 or not 0 < nivel_servicio < 1:
+        raise HTTPException(status_code=400, detail="Parámetros de pronóstico fuera de rango")
+    if dias_historia > pronostico.MAX_DIAS_HISTORIA:
+        raise HTTPException(status_code=400, detail=f"dias_historia no puede superar {pronostico.MAX_DIAS_HISTORIA}")
+    # Escrito así también rechaza nan e inf, que terminarían en un 500 al serializar
+    if not 0 <= lead_time_dias < float("inf") or not 0 <= periodo_revision_dias < float("inf"):
+        raise HTTPException(status_code=400, detail="lead_time_dias y periodo_revision_dias deben ser números no negativos")
+
+    items = pronostico.reporte_reabastecimiento(
+        db, metodo, dias_historia, ventana, alpha,
+        lead_time_dias, periodo_revision_dias, nivel_servicio, solo_reabastecer
+    )
+    return {
+        'parametros': {
+            'metodo': metodo,
+            'dias_historia': dias_historia,
+            'ventana': ventana,
+            'alpha': alpha,
+            'lead_time_dias': lead_time_dias,
+            'periodo_revision_dias': periodo_revision_dias,
+            'nivel_servicio': nivel_servicio
+        },
+        'items': items
+    }
+
+@app.get("/reportes/riesgo-vencimiento")
+def get_riesgo_vencimiento(
+    horizonte_dias: int = 180,
+    dias_consumo: int = 90,
+    db: Session = Depends(database.get_db)
+):
+    """
+    Proyecta la cantidad y el costo que vencerán antes de poder consumirse,
+    por especialidad e insumo, a partir de los lotes con stock y del consumo
+    diario de los últimos `dias_consumo` días. El resultado se cachea por día.
+    """
+    import vencimiento
+    
+    if not 0 <= horizonte_dias <= vencimiento.MAX_HORIZONTE_DIAS or not 1 <= dias_consumo <= vencimiento.MAX_DIAS_CONSUMO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Parámetros fuera de rango (horizonte_dias: 0-{vencimiento.MAX_HORIZONTE_DIAS}, "
+                   f"dias_consumo: 1-{vencimiento.MAX_DIAS_CONSUMO})"
+        )
+    return vencimiento.reporte_riesgo_vencimiento(db, horizonte_dias, dias_consumo)
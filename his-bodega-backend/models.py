@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Text, DECIMAL, TIMESTAMP, Enum, ForeignKey, DATE, DATETIME
+from sqlalchemy import Column, Integer, String, Text, DECIMAL, TIMESTAMP, Enum, ForeignKey, DATE, DATETIME, Index
 from sqlalchemy.orm import relationship  # ✅ IMPORTANTE: esta línea faltaba
 from sqlalchemy.sql import func
 from database import Base
@@ -19,6 +19,12 @@ class Especialidad(Base):  # ✅ NUEVA TABLA
     nombre = Column(String(100), unique=True, nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
+class Bodega(Base):
+    __tablename__ = "bodegas"
+    id = Column(Integer, primary_key=True, index=True)
+    nombre = Column(String(100), unique=True, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
 class Insumo(Base):
     __tablename__ = "insumos"
     id = Column(Integer, primary_key=True, index=True)
@@ -29,6 +35,8 @@ class Insumo(Base):
     stock_minimo = Column(DECIMAL(10,2), default=0.00)
     especialidad_id = Column(Integer, ForeignKey("especialidades.id"))  # ✅ NUEVO CAMPO
     created_at = Column(TIMESTAMP, server_default=func.now())
+    # En MySQL también lo actualizan los triggers de stock (ver init.migrar_insumos)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now(), index=True)
     
     # Relación con especialidad
     especialidad = relationship("Especialidad")  # ✅ Ahora sí está definido
@@ -45,8 +53,14 @@ class Entrada(Base):
     remitente_destinatario = Column(String(255))
     numero_lote = Column(String(100))
     fecha_vencimiento = Column(DATE)
+    bodega_id = Column(Integer, ForeignKey("bodegas.id"))
+    transferencia_id = Column(Integer, ForeignKey("transferencias.id"))
     created_at = Column(TIMESTAMP, server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_entradas_bodega_insumo_fecha", "bodega_id", "insumo_id", "fecha"),
+    )
+
 class Salida(Base):
     __tablename__ = "salidas"
     id = Column(Integer, primary_key=True, index=True)
@@ -59,6 +73,34 @@ class Salida(Base):
     remitente_destinatario = Column(String(255))
     numero_lote = Column(String(100))
     fecha_vencimiento = Column(DATE)
+    bodega_id = Column(Integer, ForeignKey("bodegas.id"))
+    transferencia_id = Column(Integer, ForeignKey("transferencias.id"))
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_salidas_bodega_insumo_fecha", "bodega_id", "insumo_id", "fecha"),
+        Index("ix_salidas_bodega_fecha", "bodega_id", "fecha"),
+    )
+
+class StockBodega(Base):
+    """Stock de un insumo en una bodega: una fila por (bodega, insumo), así
+    los movimientos de bodegas distintas no se bloquean entre sí."""
+    __tablename__ = "stock_bodega"
+    bodega_id = Column(Integer, ForeignKey("bodegas.id"), primary_key=True)
+    insumo_id = Column(Integer, ForeignKey("insumos.id"), primary_key=True, index=True)
+    stock_actual = Column(DECIMAL(10,2), nullable=False, default=0.00)
+
+class Transferencia(Base):
+    __tablename__ = "transferencias"
+    id = Column(Integer, primary_key=True, index=True)
+    insumo_id = Column(Integer, ForeignKey("insumos.id"), nullable=False)
+    bodega_origen_id = Column(Integer, ForeignKey("bodegas.id"), nullable=False, index=True)
+    bodega_destino_id = Column(Integer, ForeignKey("bodegas.id"), nullable=False, index=True)
+    cantidad = Column(DECIMAL(10,2), nullable=False)
+    fecha = Column(DATE, nullable=False)
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
+    numero_lote = Column(String(100))
+    fecha_vencimiento = Column(DATE)
     created_at = Column(TIMESTAMP, server_default=func.now())
 
 class Alerta(Base):
@@ -75,5 +117,26 @@ class Auditoria(Base):
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=False)
     accion = Column(String(255), nullable=False)
     detalle = Column(Text)
-    fecha = Column(DATETIME, server_default=func.now())
-    ip_address = Column(String(45))
\ No newline at end of file
+    entidad_tipo = Column(String(50))
+    entidad_id = Column(Integer)
+    fecha = Column(DATETIME, server_default=func.now(), index=True)
+    ip_address = Column(String(45))
+
+    # Índices para la paginación por (fecha, id) con cada filtro de /auditoria;
+    # sin filtros sirve el índice de fecha (InnoDB le agrega el id)
+    __table_args__ = (
+        Index("ix_auditoria_usuario_fecha_id", "usuario_id", "fecha", "id"),
+        Index("ix_auditoria_accion_fecha_id", "accion", "fecha", "id"),
+        Index("ix_auditoria_entidad_fecha_id", "entidad_tipo", "entidad_id", "fecha", "id"),
+    )
+
+class Idempotencia(Base):
+    __tablename__ = "idempotencia"
+    clave = Column(String(64), primary_key=True)  # sha256 de usuario (sub del JWT) + método + ruta + Idempotency-Key
+    metodo = Column(String(10), nullable=False)
+    ruta = Column(String(255), nullable=False)
+    huella = Column(String(64), nullable=False)  # sha256 del cuerpo de la petición
+    status_code = Column(Integer)  # NULL mientras la petición está en curso
+    content_type = Column(String(100))
+    respuesta = Column(Text)
+    expira = Column(DATETIME, nullable=False, index=True)
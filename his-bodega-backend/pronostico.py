@@ -0,0 +1,150 @@
+# pronostico.py
+"""Pronóstico de demanda y punto de reorden para todo el catálogo.
+
+Las salidas diarias se cargan con una sola consulta agregada y se arman en
+una matriz (insumos x días); todos los cálculos se hacen sobre columnas de
+NumPy, sin bucles por insumo.
+"""
+from datetime import date, timedelta
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+METODOS = ("media_movil", "suavizado")
+# La matriz de demanda ocupa insumos x días: dos años de historia como máximo
+MAX_DIAS_HISTORIA = 730
+
+
+def cargar_insumos(db: Session) -> pd.DataFrame:
+    filas = db.query(
+        models.Insumo.id,
+        models.Insumo.nombre,
+        models.Insumo.especialidad_id,
+        models.Insumo.stock_actual,
+        models.Insumo.stock_minimo
+    ).all()
+    df = pd.DataFrame(filas, columns=["insumo_id", "nombre", "especialidad_id", "stock_actual", "stock_minimo"])
+    df["stock_actual"] = df["stock_actual"].astype(float)
+    df["stock_minimo"] = df["stock_minimo"].astype(float)
+    df["especialidad_id"] = df["especialidad_id"].astype("Int64")
+    return df
+
+
+def cargar_salidas_diarias(db: Session, fecha_inicio: date, fecha_fin: date) -> pd.DataFrame:
+    filas = db.query(
+        models.Salida.insumo_id,
+        models.Salida.fecha,
+        func.sum(models.Salida.cantidad)
+    ).filter(models.Salida.fecha >= fecha_inicio)\
+     .filter(models.Salida.fecha <= fecha_fin)\
+     .filter(models.Salida.transferencia_id.is_(None))\
+     .group_by(models.Salida.insumo_id, models.Salida.fecha)\
+     .all()
+    df = pd.DataFrame(filas, columns=["insumo_id", "fecha", "cantidad"])
+    df["cantidad"] = df["cantidad"].astype(float)
+    return df
+
+
+def matriz_demanda(insumo_ids: np.ndarray, salidas: pd.DataFrame, fecha_inicio: date, dias: int) -> np.ndarray:
+    """Devuelve una matriz (len(insumo_ids), dias) con la salida total de cada día."""
+    matriz = np.zeros((len(insumo_ids), dias))
+    if salidas.empty:
+        return matriz
+    filas = pd.Index(insumo_ids).get_indexer(salidas["insumo_id"])
+    columnas = (pd.to_datetime(salidas["fecha"]) - pd.Timestamp(fecha_inicio)).dt.days.to_numpy()
+    validas = (filas >= 0) & (columnas >= 0) & (columnas < dias)
+    np.add.at(matriz, (filas[validas], columnas[validas]), salidas["cantidad"].to_numpy()[validas])
+    return matriz
+
+
+def demanda_media_movil(matriz: np.ndarray, ventana: int) -> np.ndarray:
+    return matriz[:, -ventana:].mean(axis=1)
+
+
+def demanda_suavizado(matriz: np.ndarray, alpha: float) -> np.ndarray:
+    """Suavizado exponencial simple; el nivel final es una suma ponderada de la serie."""
+    dias = matriz.shape[1]
+    edades = np.arange(dias - 1, -1, -1)
+    pesos = alpha * (1 - alpha) ** edades
+    # El primer valor arrastra el peso restante (nivel inicial = primera observación)
+    pesos[0] = (1 - alpha) ** (dias - 1)
+    return matriz @ pesos
+
+
+def calcular_reabastecimiento(
+    insumos: pd.DataFrame,
+    matriz: np.ndarray,
+    metodo: str = "media_movil",
+    ventana: int = 30,
+    alpha: float = 0.3,
+    lead_time_dias: float = 7,
+    periodo_revision_dias: float = 7,
+    nivel_servicio: float = 0.95
+) -> pd.DataFrame:
+    if metodo == "suavizado":
+        demanda = demanda_suavizado(matriz, alpha)
+    else:
+        demanda = demanda_media_movil(matriz, ventana)
+
+    desviacion = matriz[:, -ventana:].std(axis=1)
+    z = NormalDist().inv_cdf(nivel_servicio)
+    stock_seguridad = z * desviacion * np.sqrt(lead_time_dias)
+    punto_reorden = demanda * lead_time_dias + stock_seguridad
+    # El stock mínimo manual sigue actuando como piso
+    punto_reorden = np.maximum(punto_reorden, insumos["stock_minimo"].to_numpy())
+
+    stock = insumos["stock_actual"].to_numpy()
+    # Se pide lo necesario para llegar al punto de reorden más el consumo del período de revisión
+    objetivo = punto_reorden + demanda * periodo_revision_dias
+    cantidad_sugerida = np.ceil(np.maximum(objetivo - stock, 0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dias_cobertura = np.where(demanda > 0, stock / demanda, np.inf)
+
+    resultado = insumos[["insumo_id", "nombre", "especialidad_id", "stock_actual", "stock_minimo"]].copy()
+    resultado["demanda_diaria"] = demanda.round(4)
+    resultado["stock_seguridad"] = stock_seguridad.round(2)
+    resultado["punto_reorden"] = punto_reorden.round(2)
+    resultado["cantidad_sugerida"] = np.where(stock <= punto_reorden, cantidad_sugerida, 0)
+    resultado["dias_cobertura"] = dias_cobertura.round(1)
+    resultado["quiebre_antes_de_entrega"] = dias_cobertura < lead_time_dias
+    resultado["reabastecer"] = stock <= punto_reorden
+    return resultado
+
+
+def reporte_reabastecimiento(
+    db: Session,
+    metodo: str = "media_movil",
+    dias_historia: int = 90,
+    ventana: int = 30,
+    alpha: float = 0.3,
+    lead_time_dias: float = 7,
+    periodo_revision_dias: float = 7,
+    nivel_servicio: float = 0.95,
+    solo_reabastecer: bool = True
+) -> list[dict]:
+    # Hasta ayer: el día en curso está incompleto y bajaría la demanda media
+    fecha_fin = date.today() - timedelta(days=1)
+    fecha_inicio = fecha_fin - timedelta(days=dias_historia - 1)
+
+    insumos = cargar_insumos(db)
+    salidas = cargar_salidas_diarias(db, fecha_inicio, fecha_fin)
+    matriz = matriz_demanda(insumos["insumo_id"].to_numpy(), salidas, fecha_inicio, dias_historia)
+
+    resultado = calcular_reabastecimiento(
+        insumos, matriz, metodo, min(ventana, dias_historia), alpha,
+        lead_time_dias, periodo_revision_dias, nivel_servicio
+    )
+    if solo_reabastecer:
+        resultado = resultado[resultado["reabastecer"]]
+    resultado = resultado.sort_values(["quiebre_antes_de_entrega", "dias_cobertura"], ascending=[False, True])
+
+    # inf no es JSON válido: sin consumo la cobertura queda en None
+    resultado["dias_cobertura"] = resultado["dias_cobertura"].astype(object).where(np.isfinite(resultado["dias_cobertura"]), None)
+    resultado["especialidad_id"] = resultado["especialidad_id"].astype(object).where(resultado["especialidad_id"].notna(), None)
+    return resultado.to_dict("records")
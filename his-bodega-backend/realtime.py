@@ -0,0 +1,227 @@
+# realtime.py
+"""Difusión en tiempo real de cambios de stock, alertas y lotes.
+
+Las rutas que crean movimientos llaman a ``hub.emit_*``. Los eventos se
+acumulan y cada ``TICK_SEGUNDOS`` se agrupan en un solo mensaje por
+suscriptor (WebSocket ``/ws/stock`` o SSE ``/sse/stock``).
+
+Los deltas de stock y de lote son por bodega (``bodega_id``): una
+transferencia aparece como un delta negativo en el origen y uno positivo en
+el destino. Las alertas son del stock total y no llevan bodega.
+"""
+import asyncio
+import json
+import threading
+from abc import ABC, abstractmethod
+from datetime import date
+from typing import Callable, Iterable, Optional
+
+TICK_SEGUNDOS = 0.5
+MAX_MENSAJES_PENDIENTES = 100
+
+
+class Broker(ABC):
+    """Interfaz para repartir los lotes de eventos entre procesos.
+
+    ``publish`` recibe el lote ya agrupado de este proceso y debe terminar
+    llamando al handler registrado en *todos* los workers (incluido este).
+    """
+
+    def set_handler(self, handler: Callable[[dict], None]) -> None:
+        self._handler = handler
+
+    @abstractmethod
+    def publish(self, lote: dict) -> None:
+        ...
+
+
+class LocalBroker(Broker):
+    """Broker en memoria: sólo reparte dentro del proceso actual."""
+
+    def publish(self, lote: dict) -> None:
+        self._handler(lote)
+
+
+class Suscripcion:
+    def __init__(self, especialidad_ids: Optional[Iterable[int]] = None, insumo_ids: Optional[Iterable[int]] = None,
+                 bodega_ids: Optional[Iterable[int]] = None):
+        self.especialidad_ids = set(especialidad_ids) if especialidad_ids else None
+        self.insumo_ids = set(insumo_ids) if insumo_ids else None
+        self.bodega_ids = set(bodega_ids) if bodega_ids else None
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=MAX_MENSAJES_PENDIENTES)
+
+    def acepta(self, evento: dict) -> bool:
+        if self.insumo_ids is not None and evento.get("insumo_id") not in self.insumo_ids:
+            return False
+        if self.especialidad_ids is not None and evento.get("especialidad_id") not in self.especialidad_ids:
+            return False
+        # Los eventos sin bodega (alertas) pasan cualquier filtro de bodega
+        if self.bodega_ids is not None and "bodega_id" in evento and evento["bodega_id"] not in self.bodega_ids:
+            return False
+        return True
+
+    def filtrar(self, lote: dict) -> Optional[dict]:
+        mensaje = {
+            clave: [e for e in lote[clave] if self.acepta(e)]
+            for clave in ("stock", "alertas", "lotes")
+        }
+        if not any(mensaje.values()):
+            return None
+        return mensaje
+
+    def entregar(self, mensaje: dict) -> None:
+        # Si el cliente no consume, se descarta el mensaje más antiguo
+        if self.cola.full():
+            self.cola.get_nowait()
+        self.cola.put_nowait(mensaje)
+
+
+class StockHub:
+    def __init__(self, broker: Optional[Broker] = None):
+        self._lock = threading.Lock()
+        self._stock = {}
+        self._lotes = {}
+        self._alertas = []
+        self._suscripciones = set()
+        self._loop = None
+        self._tarea = None
+        self.set_broker(broker or LocalBroker())
+
+    def set_broker(self, broker: Broker) -> None:
+        self.broker = broker
+        self.broker.set_handler(self.deliver)
+
+    # --- Emisión (se llama desde las rutas, posiblemente en el threadpool) ---
+
+    def emit_stock(self, insumo_id: int, especialidad_id: Optional[int], delta: float,
+                   bodega_id: Optional[int] = None) -> None:
+        clave = (insumo_id, bodega_id)
+        with self._lock:
+            actual = self._stock.get(clave)
+            if actual is None:
+                self._stock[clave] = {
+                    "insumo_id": insumo_id,
+                    "especialidad_id": especialidad_id,
+                    "bodega_id": bodega_id,
+                    "delta": delta,
+                }
+            else:
+                actual["delta"] += delta
+
+    def emit_lote(self, insumo_id: int, especialidad_id: Optional[int], numero_lote: Optional[str],
+                  fecha_vencimiento: Optional[date], delta: float, bodega_id: Optional[int] = None) -> None:
+        clave = (insumo_id, bodega_id, numero_lote, fecha_vencimiento)
+        with self._lock:
+            actual = self._lotes.get(clave)
+            if actual is None:
+                self._lotes[clave] = {
+                    "insumo_id": insumo_id,
+                    "especialidad_id": especialidad_id,
+                    "bodega_id": bodega_id,
+                    "numero_lote": numero_lote,
+                    "fecha_vencimiento": fecha_vencimiento.isoformat() if fecha_vencimiento else None,
+                    "delta": delta,
+                }
+            else:
+                actual["delta"] += delta
+
+    def emit_alerta(self, alerta, especialidad_id: Optional[int] = None) -> None:
+        with self._lock:
+            self._alertas.append({
+                "id": alerta.id,
+                "insumo_id": alerta.insumo_id,
+                "especialidad_id": especialidad_id,
+                "mensaje": alerta.mensaje,
+                "fecha": alerta.fecha.isoformat() if alerta.fecha else None,
+            })
+
+    def emit_movimiento(self, movimiento, especialidad_id: Optional[int], signo: int,
+                        bodega_id: Optional[int] = None) -> None:
+        """Registra el delta de stock (y de lote, si aplica) de una entrada o salida."""
+        if bodega_id is None:
+            bodega_id = getattr(movimiento, "bodega_id", None)
+        delta = signo * float(movimiento.cantidad)
+        self.emit_stock(movimiento.insumo_id, especialidad_id, delta, bodega_id)
+        if movimiento.numero_lote or movimiento.fecha_vencimiento:
+            self.emit_lote(movimiento.insumo_id, especialidad_id, movimiento.numero_lote,
+                           movimiento.fecha_vencimiento, delta, bodega_id)
+
+    def emit_transferencia(self, transferencia, especialidad_id: Optional[int]) -> None:
+        """Salida en la bodega de origen y entrada en la de destino."""
+        self.emit_movimiento(transferencia, especialidad_id, -1, transferencia.bodega_origen_id)
+        self.emit_movimiento(transferencia, especialidad_id, 1, transferencia.bodega_destino_id)
+
+    # --- Agrupación por tick y reparto ---
+
+    def _drenar(self) -> Optional[dict]:
+        with self._lock:
+            if not (self._stock or self._lotes or self._alertas):
+                return None
+            lote = {
+                "stock": list(self._stock.values()),
+                "alertas": self._alertas,
+                "lotes": list(self._lotes.values()),
+            }
+            self._stock = {}
+            self._lotes = {}
+            self._alertas = []
+        return lote
+
+    async def _ticker(self):
+        while True:
+            await asyncio.sleep(TICK_SEGUNDOS)
+            lote = self._drenar()
+            if lote is not None:
+                self.broker.publish(lote)
+
+    def deliver(self, lote: dict) -> None:
+        """Handler del broker. Puede llamarse desde otro hilo."""
+        if self._loop is None:
+            return
+        try:
+            en_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            self._repartir(lote)
+        else:
+            self._loop.call_soon_threadsafe(self._repartir, lote)
+
+    def _repartir(self, lote: dict) -> None:
+        for suscripcion in list(self._suscripciones):
+            mensaje = suscripcion.filtrar(lote)
+            if mensaje is not None:
+                suscripcion.entregar(mensaje)
+
+    def iniciar(self) -> None:
+        """Arranca el ticker en el loop actual (idempotente)."""
+        if self._tarea is None or self._tarea.done():
+            self._loop = asyncio.get_running_loop()
+            self._tarea = self._loop.create_task(self._ticker())
+
+    async def suscribir(self, especialidad_ids=None, insumo_ids=None, bodega_ids=None) -> Suscripcion:
+        self.iniciar()
+        suscripcion = Suscripcion(especialidad_ids, insumo_ids, bodega_ids)
+        self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion: Suscripcion) -> None:
+        self._suscripciones.discard(suscripcion)
+
+
+def parse_ids(valor: Optional[str]) -> Optional[list[int]]:
+    """Convierte "1,2,3" en [1, 2, 3]; None o cadena vacía significa sin filtro.
+    Lanza ValueError si algún elemento no es un entero."""
+    if not valor:
+        return None
+    try:
+        return [int(x) for x in valor.split(",") if x.strip()]
+    except ValueError:
+        raise ValueError(f"Lista de ids inválida: {valor!r} (se espera p. ej. 1,2,3)")
+
+
+def formato_sse(mensaje: dict) -> str:
+    return f"event: stock\ndata: {json.dumps(mensaje)}\n\n"
+
+
+hub = StockHub()
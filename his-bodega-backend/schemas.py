@@ -1,6 +1,6 @@
 # schemas.py
 from pydantic import BaseModel
-from datetime import date
+from datetime import date, datetime
 from typing import Optional
 
 class UsuarioBase(BaseModel):
@@ -37,6 +37,18 @@ class Especialidad(EspecialidadBase):
     class Config:
         from_attributes = True
 
+class BodegaBase(BaseModel):
+    nombre: str
+
+class BodegaCreate(BodegaBase):
+    pass
+
+class Bodega(BodegaBase):
+    id: int
+    
+    class Config:
+        from_attributes = True
+
 # ✅ Esquema para Insumo - INCLUYE especialidad
 class InsumoBase(BaseModel):
     nombre: str
@@ -68,12 +80,15 @@ class EntradaBase(BaseModel):
     remitente_destinatario: Optional[str] = None
     numero_lote: Optional[str] = None
     fecha_vencimiento: Optional[date] = None
+    # None = bodega central
+    bodega_id: Optional[int] = None
 
 class EntradaCreate(EntradaBase):
     pass
 
 class Entrada(EntradaBase):
     id: int
+    transferencia_id: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -88,12 +103,34 @@ class SalidaBase(BaseModel):
     remitente_destinatario: Optional[str] = None
     numero_lote: Optional[str] = None
     fecha_vencimiento: Optional[date] = None
+    # None = bodega central
+    bodega_id: Optional[int] = None
 
 class SalidaCreate(SalidaBase):
     pass
 
 class Salida(SalidaBase):
     id: int
+    transferencia_id: Optional[int] = None
+    
+    class Config:
+        from_attributes = True
+
+class TransferenciaBase(BaseModel):
+    insumo_id: int
+    bodega_origen_id: int
+    bodega_destino_id: int
+    cantidad: float
+    fecha: date
+    usuario_id: Optional[int] = None
+    numero_lote: Optional[str] = None
+    fecha_vencimiento: Optional[date] = None
+
+class TransferenciaCreate(TransferenciaBase):
+    pass
+
+class Transferencia(TransferenciaBase):
+    id: int
     
     class Config:
         from_attributes = True
@@ -110,4 +147,22 @@ class Alerta(AlertaBase):
     id: int
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class Auditoria(BaseModel):
+    id: int
+    usuario_id: int
+    accion: str
+    detalle: Optional[str] = None
+    entidad_tipo: Optional[str] = None
+    entidad_id: Optional[int] = None
+    fecha: Optional[datetime] = None
+    ip_address: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
+class AuditoriaPagina(BaseModel):
+    items: list[Auditoria]
+    # Valor a pasar como `cursor` para pedir la página siguiente; None si no hay más
+    siguiente_cursor: Optional[str] = None
@@ -0,0 +1,206 @@
+# stock_index.py
+"""Índice de stock en memoria del proceso.
+
+Guarda columnas NumPy (id, stock_actual, stock_minimo, especialidad_id)
+ordenadas por id para responder "bajo mínimo", "stock por ids" y "totales
+por especialidad" sin ir a MySQL.
+
+El stock lo mantienen los triggers de la base, así que el índice no calcula
+nada por su cuenta: se recarga de la tabla ``insumos`` y se sincroniza
+releyendo los insumos con ``updated_at`` reciente. Esa columna cambia con
+cada UPDATE de la fila (``ON UPDATE CURRENT_TIMESTAMP``, ver init.py), tanto
+los de los triggers de entradas/salidas como las ediciones por /insumos/.
+
+``updated_at`` se fija al ejecutar el UPDATE, no al hacer commit, así que una
+transacción larga puede quedar con una marca anterior a la última
+sincronización; por eso se relee con un margen de ``MARGEN_SINCRONIZACION``.
+Un DELETE no deja marca: el worker que borra quita la fila en el momento
+(``registrar_movimiento``) y los demás la pierden en la recarga completa
+periódica (``RECARGA_CADA``).
+
+El índice es una vista eventualmente consistente: sirve para consultas y
+pre-validaciones, pero la verificación definitiva de stock se hace en la base.
+
+Es opcional: main.py sólo lo importa y carga si ``HIS_STOCK_INDEX`` no es
+``0``; mientras no esté cargado las rutas consultan MySQL.
+"""
+import threading
+import time
+from datetime import timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+
+# Cada cuánto, como máximo, se consulta la base (salvo sincronizar(forzar=True))
+INTERVALO_VERIFICACION = 1.0
+# Cada cuántos segundos se recarga la tabla completa (borrados en otros workers)
+RECARGA_CADA = 300.0
+# Cuánto antes de la última marca se vuelve a leer, para cubrir commits tardíos
+MARGEN_SINCRONIZACION = timedelta(seconds=60)
+SIN_ESPECIALIDAD = -1
+
+
+class StockIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cargado = False
+        self.ids = np.empty(0, dtype=np.int64)
+        self.stock = np.empty(0, dtype=np.float64)
+        self.minimo = np.empty(0, dtype=np.float64)
+        self.especialidad = np.empty(0, dtype=np.int32)
+        # Hora de la base al iniciar la última carga/sincronización
+        self.version = None
+        self._ultima_verificacion = 0.0
+        self._ultima_carga = 0.0
+
+    # --- Carga y sincronización con la base ---
+
+    @staticmethod
+    def _ahora_db(db: Session):
+        # Hora de la base, no del worker: updated_at la pone MySQL
+        return db.query(func.now()).scalar()
+
+    @staticmethod
+    def _filas(db: Session, ids: Optional[Iterable[int]] = None, desde=None):
+        query = db.query(
+            models.Insumo.id,
+            models.Insumo.stock_actual,
+            models.Insumo.stock_minimo,
+            models.Insumo.especialidad_id
+        )
+        if ids is not None:
+            query = query.filter(models.Insumo.id.in_(list(ids)))
+        if desde is not None:
+            query = query.filter(models.Insumo.updated_at >= desde)
+        return query.order_by(models.Insumo.id).all()
+
+    def cargar(self, db: Session) -> None:
+        version = self._ahora_db(db)
+        filas = self._filas(db)
+        n = len(filas)
+        ids = np.fromiter((f[0] for f in filas), dtype=np.int64, count=n)
+        stock = np.fromiter((f[1] or 0 for f in filas), dtype=np.float64, count=n)
+        minimo = np.fromiter((f[2] or 0 for f in filas), dtype=np.float64, count=n)
+        especialidad = np.fromiter(
+            (SIN_ESPECIALIDAD if f[3] is None else f[3] for f in filas), dtype=np.int32, count=n
+        )
+        with self._lock:
+            self.ids, self.stock, self.minimo, self.especialidad = ids, stock, minimo, especialidad
+            self.version = version
+            self._ultima_verificacion = self._ultima_carga = time.monotonic()
+            self.cargado = True
+
+    def sincronizar(self, db: Session, forzar: bool = False) -> None:
+        """Relee los insumos modificados (stock o datos) desde la última sincronización."""
+        if not self.cargado:
+            return
+        if not forzar and time.monotonic() - self._ultima_verificacion < INTERVALO_VERIFICACION:
+            return
+        if time.monotonic() - self._ultima_carga >= RECARGA_CADA:
+            self.cargar(db)
+            return
+        version = self._ahora_db(db)
+        self._ultima_verificacion = time.monotonic()
+        cambiados = self._filas(db, desde=self.version - MARGEN_SINCRONIZACION)
+        self._aplicar([f[0] for f in cambiados], cambiados)
+        with self._lock:
+            self.version = max(self.version, version)
+
+    def refrescar(self, db: Session, insumo_ids: Iterable[int]) -> None:
+        """Vuelve a leer de la base las filas indicadas (insertando o quitando si hace falta)."""
+        insumo_ids = set(insumo_ids)
+        self._aplicar(insumo_ids, self._filas(db, insumo_ids))
+
+    def _aplicar(self, insumo_ids: Iterable[int], filas) -> None:
+        """Actualiza las posiciones de `insumo_ids` con `filas`; los ids sin fila se quitan."""
+        filas = {f[0]: f for f in filas}
+        with self._lock:
+            for insumo_id in insumo_ids:
+                fila = filas.get(insumo_id)
+                pos = int(np.searchsorted(self.ids, insumo_id))
+                existe = pos < len(self.ids) and self.ids[pos] == insumo_id
+                if fila is None:
+                    if existe:
+                        self.ids = np.delete(self.ids, pos)
+                        self.stock = np.delete(self.stock, pos)
+                        self.minimo = np.delete(self.minimo, pos)
+                        self.especialidad = np.delete(self.especialidad, pos)
+                    continue
+                valores = (
+                    float(fila[1] or 0),
+                    float(fila[2] or 0),
+                    SIN_ESPECIALIDAD if fila[3] is None else fila[3]
+                )
+                if existe:
+                    self.stock[pos], self.minimo[pos], self.especialidad[pos] = valores
+                else:
+                    self.ids = np.insert(self.ids, pos, insumo_id)
+                    self.stock = np.insert(self.stock, pos, valores[0])
+                    self.minimo = np.insert(self.minimo, pos, valores[1])
+                    self.especialidad = np.insert(self.especialidad, pos, valores[2])
+
+    def registrar_movimiento(self, db: Session, insumo_id: int) -> None:
+        """Llamar después del commit de un cambio de este proceso: se refleja sin esperar al intervalo."""
+        if self.cargado:
+            self.refrescar(db, [insumo_id])
+
+    # --- Consultas ---
+
+    def bajo_minimo(self) -> np.ndarray:
+        with self._lock:
+            return self.ids[(self.stock < self.minimo) & (self.minimo > 0)]
+
+    def stock_de(self, insumo_ids: Iterable[int]) -> dict:
+        buscados = np.asarray(list(insumo_ids), dtype=np.int64)
+        with self._lock:
+            if len(self.ids) == 0:
+                return {}
+            pos = np.minimum(np.searchsorted(self.ids, buscados), len(self.ids) - 1)
+            encontrados = self.ids[pos] == buscados
+            return {int(i): float(s) for i, s in zip(buscados[encontrados], self.stock[pos[encontrados]])}
+
+    def fila(self, insumo_id: int) -> Optional[tuple]:
+        """(stock_actual, stock_minimo, especialidad_id) o None si no está indexado."""
+        with self._lock:
+            pos = int(np.searchsorted(self.ids, insumo_id))
+            if pos >= len(self.ids) or self.ids[pos] != insumo_id:
+                return None
+            especialidad = int(self.especialidad[pos])
+            return (
+                float(self.stock[pos]),
+                float(self.minimo[pos]),
+                None if especialidad == SIN_ESPECIALIDAD else especialidad
+            )
+
+    def totales_por_especialidad(self) -> list[dict]:
+        # Los ids de especialidad son enteros chicos: bincount directo, desplazado en 1 por SIN_ESPECIALIDAD
+        with self._lock:
+            totales = np.bincount(self.especialidad + 1, weights=self.stock)
+            cantidades = np.bincount(self.especialidad + 1)
+        return [
+            {
+                'especialidad_id': None if k == 0 else int(k - 1),
+                'stock_total': float(totales[k]),
+                'insumos': int(cantidades[k])
+            }
+            for k in np.flatnonzero(cantidades)
+        ]
+
+    def memoria_bytes(self) -> int:
+        return self.ids.nbytes + self.stock.nbytes + self.minimo.nbytes + self.especialidad.nbytes
+
+    def estado(self) -> dict:
+        return {
+            'cargado': self.cargado,
+            'insumos': len(self.ids),
+            'memoria_bytes': self.memoria_bytes(),
+            'bytes_por_insumo': 8 + 8 + 8 + 4,
+            'version': self.version
+        }
+
+
+indice = StockIndex()
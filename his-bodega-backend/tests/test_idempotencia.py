@@ -0,0 +1,132 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import database
+import idempotencia
+import models
+
+
+@pytest.fixture
+def entorno(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.Idempotencia.__table__.create(bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+    monkeypatch.setattr(idempotencia, "store", idempotencia.IdempotenciaStore())
+
+    llamadas = []
+    app = FastAPI()
+    app.middleware("http")(idempotencia.middleware)
+
+    @app.post("/cosas", status_code=201)
+    def crear(cosa: dict):
+        llamadas.append(cosa)
+        if cosa.get("fallar"):
+            raise HTTPException(status_code=400, detail="no")
+        return {"id": len(llamadas)}
+
+    return TestClient(app), llamadas
+
+
+def _clave(clave_cliente):
+    # Sin Authorization el usuario es ""
+    return idempotencia._sha256("", "POST", "/cosas", clave_cliente)
+
+
+def _post(cliente, cuerpo, clave="k1"):
+    return cliente.post(
+        "/cosas", content=json.dumps(cuerpo),
+        headers={idempotencia.CABECERA: clave, "Content-Type": "application/json"}
+    )
+
+
+def test_reintento_devuelve_la_respuesta_guardada(entorno):
+    cliente, llamadas = entorno
+    primera = _post(cliente, {"a": 1})
+    # Sin caché en memoria: se lee de la tabla, como en otro worker
+    idempotencia.store.cache = idempotencia.CacheTTL()
+    segunda = _post(cliente, {"a": 1})
+
+    assert primera.status_code == segunda.status_code == 201
+    assert segunda.json() == primera.json() == {"id": 1}
+    assert segunda.headers["Idempotent-Replayed"] == "true"
+    assert len(llamadas) == 1
+
+
+def test_misma_clave_con_otro_cuerpo_da_422(entorno):
+    cliente, llamadas = entorno
+    _post(cliente, {"a": 1})
+    assert _post(cliente, {"a": 2}).status_code == 422
+    assert len(llamadas) == 1
+
+
+def test_clave_en_curso_da_409(entorno):
+    cliente, llamadas = entorno
+    huella = idempotencia._sha256(json.dumps({"a": 1}).encode())
+    estado, _ = idempotencia.store.reservar(_clave("k1"), "POST", "/cosas", huella)
+    assert estado == idempotencia.store.RESERVADA
+
+    respuesta = _post(cliente, {"a": 1})
+    assert respuesta.status_code == 409
+    assert respuesta.headers["Retry-After"] == "1"
+    assert llamadas == []
+
+
+def test_respuesta_no_2xx_libera_la_reserva(entorno):
+    cliente, llamadas = entorno
+    assert _post(cliente, {"fallar": True}).status_code == 400
+    assert _post(cliente, {"fallar": True}).status_code == 400
+    assert len(llamadas) == 2
+
+
+def test_reserva_vencida_se_retoma(entorno):
+    cliente, llamadas = entorno
+    db = database.SessionLocal()
+    db.add(models.Idempotencia(
+        clave=_clave("k1"), metodo="POST", ruta="/cosas", huella="otra",
+        status_code=None, expira=datetime.utcnow() - timedelta(seconds=1)
+    ))
+    db.commit()
+    db.close()
+
+    assert _post(cliente, {"a": 1}).status_code == 201
+    assert len(llamadas) == 1
+
+
+def test_renovar_extiende_la_reserva(entorno):
+    store = idempotencia.store
+    store.reservar("x", "POST", "/cosas", "h")
+    db = database.SessionLocal()
+    db.query(models.Idempotencia).update({models.Idempotencia.expira: datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    store.renovar("x")
+    db.expire_all()
+    assert db.query(models.Idempotencia.expira).scalar() > datetime.utcnow()
+    db.close()
+    assert store.reservar("x", "POST", "/cosas", "h")[0] == store.EN_CURSO
+
+
+def test_purgar_borra_vencidas_en_lotes(entorno):
+    db = database.SessionLocal()
+    ahora = datetime.utcnow()
+    for i in range(5):
+        db.add(models.Idempotencia(
+            clave=f"v{i}", metodo="POST", ruta="/cosas", huella="h", status_code=201, expira=ahora - timedelta(hours=1)
+        ))
+    db.add(models.Idempotencia(
+        clave="viva", metodo="POST", ruta="/cosas", huella="h", status_code=201, expira=ahora + timedelta(hours=1)
+    ))
+    db.commit()
+    db.close()
+
+    assert idempotencia.store.purgar(limite=2) == 2
+    assert idempotencia.store.purgar(limite=10) == 3
+    db = database.SessionLocal()
+    assert [c for (c,) in db.query(models.Idempotencia.clave).all()] == ["viva"]
+    db.close()
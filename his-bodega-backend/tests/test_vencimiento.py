@@ -0,0 +1,70 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+import vencimiento
+
+HOY = date(2026, 10, 19)
+
+
+def _insumos(stock):
+    return pd.DataFrame({
+        "insumo_id": [1],
+        "nombre": ["Gasa"],
+        "especialidad_id": pd.array([1], dtype="Int64"),
+        "stock_actual": [float(stock)],
+        "stock_minimo": [0.0],
+    })
+
+
+def _lotes(*lotes):
+    return pd.DataFrame(
+        [(1, nombre, HOY + timedelta(days=dias), float(cantidad), 2.0) for nombre, dias, cantidad in lotes],
+        columns=["insumo_id", "numero_lote", "fecha_vencimiento", "cantidad", "precio_unitario"],
+    )
+
+
+def _por_lote(riesgo):
+    return riesgo.set_index("numero_lote")
+
+
+def test_stock_se_asigna_a_los_lotes_que_vencen_ultimo():
+    # VIEJO se consumió hace meses (FEFO); el stock actual es el lote NUEVO
+    riesgo = _por_lote(vencimiento.calcular_riesgo(
+        _insumos(100),
+        _lotes(("VIEJO", -200, 100), ("NUEVO", 700, 100)),
+        pd.Series({1: 0.5}),
+        HOY,
+    ))
+    assert riesgo.loc["VIEJO", "cantidad_restante"] == 0
+    assert riesgo.loc["VIEJO", "cantidad_vencida"] == 0
+    assert riesgo.loc["NUEVO", "cantidad_restante"] == 100
+    assert riesgo["cantidad_a_vencer"].sum() == 0
+
+
+def test_stock_en_lotes_vencidos_se_informa_aparte():
+    riesgo = _por_lote(vencimiento.calcular_riesgo(
+        _insumos(150),
+        _lotes(("VIEJO", -5, 100), ("NUEVO", 700, 100)),
+        pd.Series({1: 1.0}),
+        HOY,
+    ))
+    assert riesgo.loc["VIEJO", "cantidad_vencida"] == 50
+    assert riesgo.loc["VIEJO", "cantidad_a_vencer"] == 0
+    assert riesgo.loc["VIEJO", "costo_vencido"] == 100
+    assert riesgo.loc["NUEVO", "cantidad_a_vencer"] == 0
+
+
+def test_consumo_proyectado_fefo():
+    # Stock 100 en C(40), B(40) y A(20); consumo 1/día
+    riesgo = _por_lote(vencimiento.calcular_riesgo(
+        _insumos(100),
+        _lotes(("A", 10, 40), ("B", 20, 40), ("C", 100, 40)),
+        pd.Series({1: 1.0}),
+        HOY,
+    ))
+    assert riesgo.loc["A", "cantidad_restante"] == 20
+    assert riesgo.loc["A", "cantidad_a_vencer"] == 10
+    assert riesgo.loc["B", "cantidad_a_vencer"] == 30
+    assert riesgo.loc["C", "cantidad_a_vencer"] == 0
+    assert riesgo["costo_a_vencer"].sum() == 80
@@ -1,5 +1,4 @@
 # utils.py
-import utils
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
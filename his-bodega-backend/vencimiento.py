@@ -0,0 +1,180 @@
+# vencimiento.py
+"""Riesgo de vencimiento: cuánto stock (y cuánto dinero) vencerá antes de consumirse.
+
+Se hace una consulta por tabla y el resto es aritmética de columnas:
+
+* Con despacho FEFO los lotes que vencen primero se consumieron primero, así
+  que el stock actual se asigna a los lotes que vencen *último*.
+* Lo que queda asignado a lotes ya vencidos se informa aparte (``vencido``),
+  no como riesgo futuro.
+* El consumo se proyecta a la tasa diaria reciente, consumiendo los lotes en
+  orden de vencimiento. Lo consumido acumulado hasta el lote i es
+  ``S_i = min(S_{i-1} + q_i, tasa * t_i)``, que en forma cerrada es
+  ``Q_i + min(0, cummin(tasa * t_j - Q_j))`` y se calcula con ``cummin``.
+"""
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models
+import pronostico
+
+SIN_ESPECIALIDAD = "Sin especialidad"
+MAX_HORIZONTE_DIAS = 730
+MAX_DIAS_CONSUMO = pronostico.MAX_DIAS_HISTORIA
+# Combinaciones de parámetros que se guardan por día
+MAX_CACHE = 32
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cargar_lotes(db: Session) -> pd.DataFrame:
+    filas = db.query(
+        models.Entrada.insumo_id,
+        models.Entrada.numero_lote,
+        models.Entrada.fecha_vencimiento,
+        models.Entrada.cantidad,
+        models.Entrada.precio_unitario
+    ).filter(models.Entrada.cantidad > 0, models.Entrada.transferencia_id.is_(None)).all()
+    df = pd.DataFrame(filas, columns=["insumo_id", "numero_lote", "fecha_vencimiento", "cantidad", "precio_unitario"])
+    df["cantidad"] = df["cantidad"].astype(float)
+    df["precio_unitario"] = df["precio_unitario"].fillna(0).astype(float)
+    return df
+
+
+def cargar_consumo(db: Session, fecha_inicio: date, fecha_fin: date) -> pd.Series:
+    filas = db.query(
+        models.Salida.insumo_id,
+        func.sum(models.Salida.cantidad)
+    ).filter(models.Salida.fecha >= fecha_inicio)\
+     .filter(models.Salida.fecha <= fecha_fin)\
+     .filter(models.Salida.transferencia_id.is_(None))\
+     .group_by(models.Salida.insumo_id)\
+     .all()
+    return pd.Series({insumo_id: float(total) for insumo_id, total in filas}, dtype=float)
+
+
+def calcular_riesgo(insumos: pd.DataFrame, lotes: pd.DataFrame, tasa_diaria: pd.Series, hoy: date) -> pd.DataFrame:
+    """Devuelve un DataFrame por lote con cantidad restante, cantidad ya vencida,
+    consumo proyectado y cantidad a vencer."""
+    stock = insumos.set_index("insumo_id")["stock_actual"]
+    lotes = lotes[lotes["insumo_id"].isin(stock.index)].copy()
+
+    vence = pd.to_datetime(lotes["fecha_vencimiento"])
+    lotes["dias_para_vencer"] = (vence - pd.Timestamp(hoy)).dt.days.astype(float).fillna(np.inf)
+
+    # Asignación del stock actual: primero a los lotes que vencen más tarde
+    lotes = lotes.sort_values(["insumo_id", "dias_para_vencer"], ascending=[True, False], kind="stable")
+    acumulado = lotes.groupby("insumo_id", sort=False)["cantidad"].cumsum().to_numpy()
+    previo = acumulado - lotes["cantidad"].to_numpy()
+    stock_lote = stock.reindex(lotes["insumo_id"]).to_numpy()
+    lotes["cantidad_restante"] = np.clip(stock_lote - previo, 0, lotes["cantidad"].to_numpy())
+
+    # Lo asignado a lotes ya vencidos no se puede consumir: va aparte
+    vencido = lotes["dias_para_vencer"].to_numpy() < 0
+    lotes["cantidad_vencida"] = np.where(vencido, lotes["cantidad_restante"], 0.0)
+    lotes["costo_vencido"] = lotes["cantidad_vencida"] * lotes["precio_unitario"]
+
+    # Consumo proyectado antes de cada vencimiento, en orden FEFO
+    lotes = lotes.sort_values(["insumo_id", "dias_para_vencer"], kind="stable")
+    por_insumo = lotes.groupby("insumo_id", sort=False)
+    restante = np.where(lotes["dias_para_vencer"].to_numpy() < 0, 0.0, lotes["cantidad_restante"].to_numpy())
+    dias = lotes["dias_para_vencer"].clip(lower=0).to_numpy()
+    tasa = tasa_diaria.reindex(lotes["insumo_id"]).fillna(0).to_numpy()
+    lotes["_q"] = restante
+    q_acum = por_insumo["_q"].cumsum().to_numpy()
+    with np.errstate(invalid="ignore"):
+        capacidad = np.where(np.isinf(dias), np.inf, tasa * dias)
+    lotes["_holgura"] = capacidad - q_acum
+    minimo = lotes.groupby("insumo_id", sort=False)["_holgura"].cummin().to_numpy()
+    consumido_acum = q_acum + np.minimum(0, minimo)
+    consumido_previo = consumido_acum - np.concatenate(([0.0], consumido_acum[:-1]))
+    primero = ~lotes["insumo_id"].duplicated().to_numpy()
+    consumido = np.where(primero, consumido_acum, consumido_previo)
+
+    lotes["cantidad_a_vencer"] = np.clip(restante - consumido, 0, None)
+    lotes["costo_a_vencer"] = lotes["cantidad_a_vencer"] * lotes["precio_unitario"]
+    return lotes.drop(columns=["_q", "_holgura"])
+
+
+def reporte_riesgo_vencimiento(db: Session, horizonte_dias: int = 180, dias_consumo: int = 90) -> dict:
+    hoy = date.today()
+    clave = (hoy, horizonte_dias, dias_consumo)
+    with _cache_lock:
+        if clave in _cache:
+            return _cache[clave]
+
+    insumos = pronostico.cargar_insumos(db)
+    lotes = cargar_lotes(db)
+    # dias_consumo días completos hasta ayer, igual que pronostico: hoy aún está incompleto
+    consumo = cargar_consumo(db, hoy - timedelta(days=dias_consumo), hoy - timedelta(days=1))
+    especialidades = dict(db.query(models.Especialidad.id, models.Especialidad.nombre).all())
+
+    riesgo = calcular_riesgo(insumos, lotes, consumo / dias_consumo, hoy)
+    a_vencer = (riesgo["cantidad_a_vencer"] > 0) & (riesgo["dias_para_vencer"] <= horizonte_dias)
+    riesgo = riesgo[a_vencer | (riesgo["cantidad_vencida"] > 0)]
+    riesgo = riesgo.merge(insumos[["insumo_id", "nombre", "especialidad_id"]], on="insumo_id")
+    riesgo["especialidad"] = riesgo["especialidad_id"].map(especialidades).fillna(SIN_ESPECIALIDAD)
+
+    reporte = {}
+    for (especialidad, insumo_id, nombre), grupo in riesgo.groupby(["especialidad", "insumo_id", "nombre"], sort=True):
+        datos = reporte.setdefault(especialidad, {
+            'total_cantidad': 0.0,
+            'total_costo': 0.0,
+            'total_cantidad_vencida': 0.0,
+            'total_costo_vencido': 0.0,
+            'insumos': []
+        })
+        cantidad = float(grupo["cantidad_a_vencer"].sum())
+        costo = float(grupo["costo_a_vencer"].sum())
+        cantidad_vencida = float(grupo["cantidad_vencida"].sum())
+        costo_vencido = float(grupo["costo_vencido"].sum())
+        datos['insumos'].append({
+            'insumo_id': int(insumo_id),
+            'insumo': nombre,
+            'cantidad': round(cantidad, 2),
+            'costo': round(costo, 2),
+            'cantidad_vencida': round(cantidad_vencida, 2),
+            'costo_vencido': round(costo_vencido, 2),
+            'lotes': [
+                {
+                    'numero_lote': lote.numero_lote,
+                    'fecha_vencimiento': lote.fecha_vencimiento,
+                    'cantidad_restante': round(float(lote.cantidad_restante), 2),
+                    'cantidad_vencida': round(float(lote.cantidad_vencida), 2),
+                    'cantidad_a_vencer': round(float(lote.cantidad_a_vencer), 2),
+                    'costo_a_vencer': round(float(lote.costo_a_vencer), 2)
+                }
+                for lote in grupo.itertuples()
+            ]
+        })
+        datos['total_cantidad'] += cantidad
+        datos['total_costo'] += costo
+        datos['total_cantidad_vencida'] += cantidad_vencida
+        datos['total_costo_vencido'] += costo_vencido
+
+    resultado = {
+        'fecha': hoy,
+        'horizonte_dias': horizonte_dias,
+        'dias_consumo': dias_consumo,
+        'total_cantidad': round(float(riesgo["cantidad_a_vencer"].sum()), 2),
+        'total_costo': round(float(riesgo["costo_a_vencer"].sum()), 2),
+        # Stock asignado a lotes ya vencidos (pérdida ya ocurrida, no riesgo futuro)
+        'total_cantidad_vencida': round(float(riesgo["cantidad_vencida"].sum()), 2),
+        'total_costo_vencido': round(float(riesgo["costo_vencido"].sum()), 2),
+        'especialidades': reporte
+    }
+    with _cache_lock:
+        # Sólo se conserva el cálculo del día en curso
+        for vieja in [k for k in _cache if k[0] != hoy]:
+            del _cache[vieja]
+        # El dict conserva el orden de inserción: se descarta la combinación más antigua
+        while len(_cache) >= MAX_CACHE:
+            del _cache[next(iter(_cache))]
+        _cache[clave] = resultado
+    return resultado